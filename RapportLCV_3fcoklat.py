@@ -1,27 +1,198 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
 from docx import Document
 from docx.shared import Pt, Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import io
+import csv
+import math
+import openpyxl
 import PyPDF2
-from PIL import Image
+from PIL import Image, ImageOps, ImageSequence
+from collections import OrderedDict, deque
 import pytesseract
 import time
 import hashlib
 import json
+import re
+import sys
+import argparse
+import sqlite3
+import threading
+import shutil
+import tempfile
+import zipfile
+import uuid
+import functools
+import contextvars
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from requests.exceptions import Timeout, ConnectionError
 
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # Streamlit versi lama tidak menyediakan API konteks thread
+    add_script_run_ctx = get_script_run_ctx = None
+
+# Streamlit baru menerima callable sebagai data download_button: isi file baru dibaca saat tombol diklik
+try:
+    from streamlit.elements.widgets.button import DownloadButtonDataType
+    DEFERRED_DOWNLOAD = 'Callable' in str(DownloadButtonDataType)
+except ImportError:  # Streamlit versi lama: data harus sudah berupa bytes saat tombol dirender
+    DEFERRED_DOWNLOAD = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # Tanpa pyarrow, workbook selalu di-parse langsung dari .xlsx
+    pa = feather = None
+
 # Set path Tesseract untuk Windows
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-# Konfigurasi API DeepSeek (AMAN melalui secrets)
-DEEPSEEK_API_KEY = st.secrets["deepseek"]["api_key"]
+# Konfigurasi API DeepSeek (AMAN melalui secrets, atau env DEEPSEEK_API_KEY untuk mode batch)
+try:
+    DEEPSEEK_API_KEY = st.secrets["deepseek"]["api_key"]
+except Exception:
+    DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
 DEEPSEEK_MODEL = "deepseek-chat"  # Model yang pasti tersedia dan stabil
 
+# Fungsi untuk membaca pengaturan deployment dari secrets [rapport] atau environment variable RAPPORT_*
+def get_setting(name, default):
+    try:
+        value = st.secrets.get("rapport", {}).get(name)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.environ.get(f"RAPPORT_{name.upper()}")
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ('1', 'true', 'yes', 'ya', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+# Batas jumlah bagian analisis yang dijalankan bersamaan untuk satu laporan
+ANALYSIS_MAX_WORKERS = get_setting("max_workers", 5)
+
+# Cache respons LLM di disk (kunci: hash model, prompt, temperature, max_tokens)
+LLM_CACHE_ENABLED = get_setting("llm_cache", True)
+LLM_CACHE_PATH = get_setting("llm_cache_path", os.path.join(".cache", "llm_responses.sqlite3"))
+LLM_CACHE_MAX_MB = get_setting("llm_cache_max_mb", 200)
+LLM_CACHE_MAX_AGE_DAYS = get_setting("llm_cache_max_age_days", 30)
+LLM_CACHE_STATS_TTL = 30  # detik; statistik cache di sidebar tidak dihitung ulang pada setiap rerun
+
+# Koneksi HTTP ke DeepSeek; base URL bisa diarahkan ke server stub lokal untuk pengujian dan load test
+DEEPSEEK_BASE_URL = get_setting("deepseek_base_url", "https://api.deepseek.com/v1")
+HTTP_POOL_SIZE = get_setting("http_pool_size", 16)
+HTTP_CONNECT_TIMEOUT = get_setting("http_connect_timeout", 10.0)
+
+# Mode streaming (server-sent events): teks ditampilkan di tab hasil selagi token diterima
+STREAMING_DEFAULT = get_setting("streaming", True)
+STREAM_UPDATE_INTERVAL = 0.1  # detik, batas frekuensi pembaruan tampilan
+
+# Snapshot kolumnar (Arrow IPC/Feather) dari sheet di folder documents agar startup tidak mem-parse XML
+SNAPSHOT_ENABLED = get_setting("snapshot", True)
+SNAPSHOT_DIR = get_setting("snapshot_dir", os.path.join(".cache", "snapshots"))
+SNAPSHOT_VERSION = "1"  # Naikkan jika isi snapshot (mis. kolom turunan) berubah
+
+# Batas karakter dokumen upload yang dipakai dalam prompt; ekstraksi berhenti setelah batas tercapai
+PCB_CHAR_BUDGET = 4000
+IMPACT_CHAR_BUDGET = 3000
+
+# Dokumen Impact yang lebih panjang dari IMPACT_CHAR_BUDGET diringkas dengan map-reduce:
+# dipotong per IMPACT_CHUNK_CHARS, tiap potongan diringkas paralel dengan jatah IMPACT_CHAR_BUDGET / jumlah potongan
+# (minimal IMPACT_SUMMARY_MIN_CHARS), diulang sampai gabungan ringkasan muat, lalu ringkasannya dianalisis
+IMPACT_MAX_CHARS = get_setting("impact_max_chars", 60000)  # 0 = dokumen Impact dibaca lengkap
+IMPACT_CHUNK_CHARS = get_setting("impact_chunk_chars", 3000)
+IMPACT_SUMMARY_MAX_TOKENS = 300
+IMPACT_SUMMARY_MIN_CHARS = 150
+IMPACT_MAP_WORKERS = get_setting("impact_map_workers", 4)
+
+# Excel upload dibaca streaming (openpyxl read-only) menjadi CSV ringkas per sheet.
+# excel_row_sampling: jika baris tidak muat dalam batas karakter, ambil sampel merata dari seluruh sheet
+EXCEL_ROW_SAMPLING = get_setting("excel_row_sampling", False)
+EXCEL_SAMPLING_PROBE_ROWS = 20  # Baris awal yang dipakai memperkirakan panjang rata-rata baris
+
+# Ekstraksi PDF paralel (process pool) hanya untuk teks lengkap dari PDF besar (mis. impact_max_chars = 0).
+# Default nonaktif karena worker proses perlu bisa meng-import modul ini (aman di mode batch).
+PDF_PARALLEL = get_setting("pdf_parallel", False)
+PDF_PARALLEL_MIN_PAGES = get_setting("pdf_parallel_min_pages", 40)
+PDF_PROCESS_WORKERS = get_setting("pdf_workers", os.cpu_count() or 2)
+
+# Pipeline OCR: gambar diperkecil ke DPI target, dibinarisasi, dipotong per halaman/tile lalu di-OCR paralel
+OCR_LANG = 'ind+eng'
+OCR_TARGET_DPI = get_setting("ocr_target_dpi", 300)
+OCR_MAX_SIDE = get_setting("ocr_max_side", 3500)  # px, untuk foto tanpa info DPI
+OCR_TILE_HEIGHT = get_setting("ocr_tile_height", 1800)  # px, gambar lebih tinggi dipotong menjadi beberapa tile
+OCR_WORKERS = get_setting("ocr_workers", os.cpu_count() or 2)
+OCR_CACHE_MAX_ENTRIES = get_setting("ocr_cache_max_entries", 256)
+
+# Cache hasil ekstraksi upload: memori (dibagi semua sesi) dan opsional SQLite di disk
+UPLOAD_CACHE_MAX_MB = get_setting("upload_cache_max_mb", 64)
+UPLOAD_CACHE_PERSIST = get_setting("upload_cache_persist", False)
+UPLOAD_CACHE_PATH = get_setting("upload_cache_path", os.path.join(".cache", "uploads.sqlite3"))
+UPLOAD_CACHE_DISK_MAX_MB = get_setting("upload_cache_disk_max_mb", 200)
+UPLOAD_CACHE_MAX_AGE_DAYS = get_setting("upload_cache_max_age_days", 7)
+
+# Mode analisis PCB: 'separate' (dua permintaan) atau 'combined' (satu permintaan JSON untuk
+# Strategi dan Program Budaya, data PCB hanya dikirim sekali)
+PCB_ANALYSIS_MODE = get_setting("pcb_analysis_mode", "separate")
+
+# Batas global request DeepSeek yang berjalan bersamaan dalam satu proses (semua sesi dan batch)
+API_CONCURRENCY_LIMIT = get_setting("api_concurrency", 8)
+_api_semaphore = threading.BoundedSemaphore(API_CONCURRENCY_LIMIT)
+
+def set_api_concurrency(limit):
+    global API_CONCURRENCY_LIMIT, _api_semaphore
+    API_CONCURRENCY_LIMIT = max(1, int(limit))
+    _api_semaphore = threading.BoundedSemaphore(API_CONCURRENCY_LIMIT)
+
+# Rate limiter bersama (token bucket request/menit dan token/menit, 0 = tanpa batas) dan circuit breaker
+API_REQUESTS_PER_MINUTE = get_setting("api_rpm", 300)
+API_TOKENS_PER_MINUTE = get_setting("api_tpm", 0)
+API_BURST_SECONDS = get_setting("api_burst_seconds", 10.0)  # Kapasitas bucket = jatah sekian detik
+API_RETRY_AFTER_DEFAULT = get_setting("api_retry_after_default", 5.0)  # detik, jika 429 tanpa Retry-After
+RATE_LIMIT_MAX_BACKOFF = get_setting("rate_limit_max_backoff", 60.0)  # detik, batas atas penahanan dari Retry-After
+BREAKER_FAILURE_THRESHOLD = get_setting("breaker_failures", 5)
+BREAKER_RESET_SECONDS = get_setting("breaker_reset_seconds", 30.0)
+
+# Template .docx berisi style laporan; kosong = template bawaan (Calibri 11) yang dibangun sekali per proses
+DOCX_TEMPLATE_PATH = get_setting("docx_template", "")
+
+# Ekspor ZIP: folder upload per Fungsi (struktur sama dengan mode batch) dan jumlah laporan paralel.
+# Job ekspor memakai antrian sendiri (EXPORT_MAX_CONCURRENT) agar tidak menahan slot job laporan.
+UPLOADS_DIR = get_setting("uploads_dir", "uploads")
+EXPORT_WORKERS = get_setting("export_workers", 2)
+EXPORT_MAX_CONCURRENT = get_setting("export_max_concurrent", 1)
+
+# Jumlah hasil bagian (per sidik jari input) yang disimpan di sesi untuk dipakai ulang
+SECTION_STORE_MAX_ENTRIES = get_setting("section_store_entries", 50)
+
+# Batas memori hasil laporan (analisis + .docx) yang disimpan per sesi; yang paling lama tidak dibuka dibuang dulu
+RESULT_STORE_MAX_MB = get_setting("result_store_max_mb", 50)
+
+# Job laporan latar belakang: dibagi semua sesi, hasil disimpan sampai kedaluwarsa
+JOB_MAX_CONCURRENT = get_setting("job_max_concurrent", 2)
+JOB_TTL_MINUTES = get_setting("job_ttl_minutes", 60)
+JOB_POLL_INTERVAL = get_setting("job_poll_interval", 0.5)  # detik antar pembaruan status di UI
+JOB_MAX_NOTICES = 50  # Pesan pipeline (peringatan, info OCR) yang disimpan per job
+
+# Instrumentasi performa: span per tahap ditulis ke log JSONL lokal
+PERF_LOG_ENABLED = get_setting("perf_log", True)
+PERF_LOG_PATH = get_setting("perf_log_path", os.path.join("logs", "perf_spans.jsonl"))
+PERF_LOG_MAX_MB = get_setting("perf_log_max_mb", 20)  # Melebihi ini log dirotasi ke <path>.1 (satu generasi lama)
+PERF_PANEL_RUNS = get_setting("perf_panel_runs", 50)  # Jumlah run terakhir di panel diagnostik
+
 # Konfigurasi halaman
 st.set_page_config(
     page_title="Rapport Writer Assistance",
@@ -29,6 +200,156 @@ st.set_page_config(
     layout="wide"
 )
 
+# ===================== PESAN PIPELINE =====================
+# Peringatan/info dari pipeline analisis. Job latar belakang tidak punya ScriptRunContext sehingga st.* di
+# thread-nya tidak tampil; job memasang penampung lewat contextvar dan pesannya dirender UI saat polling.
+_notice_sink = contextvars.ContextVar('rapport_notice_sink', default=None)
+
+def notify(level, message):
+    sink = _notice_sink.get()
+    if sink is not None:
+        sink(level, message)
+    else:
+        getattr(st, level)(message)
+
+# ===================== INSTRUMENTASI PERFORMA =====================
+# Span aktif disimpan di contextvar sehingga span anak (mis. setiap percobaan API) otomatis
+# terhubung ke induknya; run_concurrently menyalin context ini ke setiap worker thread.
+_current_span = contextvars.ContextVar('rapport_current_span', default=None)
+
+# Penulis log span JSONL; append satu baris per span sehingga aman dipakai banyak thread/proses
+class PerfRecorder:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._rotate_if_full()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    # Rotasi berbasis ukuran: file penuh dipindah ke <path>.1 (menimpa generasi sebelumnya)
+    def _rotate_if_full(self):
+        try:
+            if os.path.getsize(self.path) >= PERF_LOG_MAX_MB * 1024 * 1024:
+                os.replace(self.path, self.path + ".1")
+        except OSError:
+            pass
+
+    @staticmethod
+    def _read_tail(path, tail_bytes):
+        if tail_bytes <= 0 or not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - tail_bytes))
+            lines = f.read().decode('utf-8', errors='ignore').splitlines()
+        if size > tail_bytes:
+            lines = lines[1:]  # Baris pertama kemungkinan terpotong
+        return lines
+
+    # Span dari max_runs run terakhir; hanya ekor file yang dibaca agar tetap cepat saat log membesar.
+    # Jika file aktif baru dirotasi, sisa jatah dibaca dari ekor <path>.1.
+    def load_recent(self, max_runs=50, tail_bytes=4 * 1024 * 1024):
+        lines = self._read_tail(self.path, tail_bytes)
+        current_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        lines = self._read_tail(self.path + ".1", tail_bytes - current_size) + lines
+        if not lines:
+            return pd.DataFrame()
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        spans = pd.DataFrame(entries)
+        if spans.empty:
+            return spans
+        recent_runs = spans.groupby('run_id')['start'].min().nlargest(max_runs).index
+        return spans[spans['run_id'].isin(recent_runs)]
+
+@st.cache_resource(show_spinner=False)
+def get_perf_recorder():
+    if not PERF_LOG_ENABLED:
+        return None
+    try:
+        return PerfRecorder(PERF_LOG_PATH)
+    except OSError:
+        return None
+
+# Context manager span: mencatat durasi, status, dan atribut (percobaan, token, cache hit, dst.)
+class span:
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        self.run_id = parent.run_id if parent else self.span_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        _current_span.reset(self._token)
+        recorder = get_perf_recorder()
+        if recorder is not None:
+            entry = {
+                'run_id': self.run_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'name': self.name,
+                'start': self.started_at,
+                'duration_ms': round(duration_ms, 2),
+                'status': 'exception' if exc_type else self.attrs.pop('status', 'ok')
+            }
+            entry.update(self.attrs)
+            try:
+                recorder.record(entry)
+            except OSError:
+                pass
+        return False
+
+# Menambahkan atribut ke span yang sedang aktif (jika ada)
+def annotate_span(**attrs):
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+# Decorator: bungkus pemanggilan fungsi dalam span; hasil teks error ditandai status error_response,
+# kecuali fungsi sudah menetapkan status yang lebih spesifik (mis. circuit_open)
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = func(*args, **kwargs)
+                if isinstance(result, str):
+                    current.set(result_chars=len(result))
+                    if is_error_response(result) and 'status' not in current.attrs:
+                        current.set(status='error_response')
+                return result
+        return wrapper
+    return decorator
+
+# Jeda backoff dicatat sebagai span tersendiri agar waktu tunggu retry terlihat di panel diagnostik
+def backoff_sleep(seconds, reason):
+    with span('deepseek.backoff', seconds=seconds, reason=reason):
+        time.sleep(seconds)
+
 # Fungsi untuk normalisasi nama HSH
 def normalize_hsh(hsh_name):
     if pd.isna(hsh_name):
@@ -37,71 +358,600 @@ def normalize_hsh(hsh_name):
     normalized = ' '.join(normalized.split())
     return normalized
 
-def find_matching_hsh(target_hsh, hsh_list):
-    target_normalized = normalize_hsh(target_hsh)
-    for hsh in hsh_list:
-        if normalize_hsh(hsh) == target_normalized:
-            return hsh
-    for hsh in hsh_list:
-        normalized = normalize_hsh(hsh)
-        if target_normalized in normalized or normalized in target_normalized:
-            return hsh
-    return None
+# Skor minimum kemiripan trigram (koefisien Dice) agar HSH dianggap cocok tanpa saling memuat
+HSH_MATCH_MIN_SCORE = 0.6
+HSH_DEFAULT_BENCHMARK = 'PERTAMINA GROUP'
+# Trigram yang muncul di lebih dari bagian ini dari seluruh baris (dan minimal HSH_COMMON_GRAM_MIN_ROWS baris),
+# mis. " SH" atau "SH ", tidak dipakai mencari kandidat agar biaya lookup tidak tumbuh linear dengan jumlah baris
+HSH_COMMON_GRAM_SHARE = 0.2
+HSH_COMMON_GRAM_MIN_ROWS = 50
+
+# Hasil pencocokan HSH: nilai asli, posisi baris, skor 0-1, metode, dan alasan yang bisa dibaca
+HSHMatch = namedtuple('HSHMatch', ['value', 'position', 'score', 'method', 'reason'])
+
+def hsh_ngrams(normalized, n=3):
+    padded = f" {normalized} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+# Indeks pencocokan HSH yang dibangun sekali per dataset: peta exact + indeks trigram.
+# Urutan prioritas sama dengan pencocokan lama (identik, lalu saling memuat), ditambah kemiripan trigram;
+# kandidat dengan skor sama diurutkan menurut posisi baris sehingga hasilnya deterministik.
+# Kandidat hanya diambil dari trigram yang jarang; skor Dice tetap dihitung dari seluruh trigram kandidat.
+class HSHMatcher:
+    def __init__(self, hsh_values):
+        self.values = list(hsh_values)
+        self.normalized = [normalize_hsh(value) for value in self.values]
+        self.exact = {}
+        self.gram_index = defaultdict(list)
+        self.gram_sets = []
+        self.short_positions = []  # Nama < 3 huruf tidak punya trigram internal, dicek langsung
+        self.default_position = None
+        self.common_gram_rows = max(HSH_COMMON_GRAM_MIN_ROWS, int(HSH_COMMON_GRAM_SHARE * len(self.values)))
+        for position, normalized in enumerate(self.normalized):
+            grams = hsh_ngrams(normalized) if normalized else set()
+            self.gram_sets.append(grams)
+            if not normalized:
+                continue
+            self.exact.setdefault(normalized, position)
+            for gram in grams:
+                self.gram_index[gram].append(position)
+            if len(normalized) < 3:
+                self.short_positions.append(position)
+            if self.default_position is None and HSH_DEFAULT_BENCHMARK in normalized:
+                self.default_position = position
+        if self.default_position is None and self.values:
+            self.default_position = 0
+
+    def candidates(self, target_hsh, limit=5):
+        target = normalize_hsh(target_hsh)
+        if not target:
+            return []
+        if target in self.exact:
+            position = self.exact[target]
+            return [HSHMatch(self.values[position], position, 1.0, 'exact',
+                             f"Nama HSH identik setelah normalisasi ('{target}')")]
+
+        target_grams = hsh_ngrams(target)
+        if len(target) < 3:
+            positions = range(len(self.values))
+        else:
+            # Trigram umum dilewati; jika semua trigram target umum, pakai satu trigram yang paling jarang
+            rare = [gram for gram in target_grams if len(self.gram_index.get(gram, ())) <= self.common_gram_rows]
+            lookup = rare or [min(target_grams, key=lambda gram: (len(self.gram_index.get(gram, ())), gram))]
+            positions = set(self.short_positions)
+            for gram in lookup:
+                positions.update(self.gram_index.get(gram, ()))
+
+        ranked = []
+        for position in positions:
+            candidate = self.normalized[position]
+            if not candidate:
+                continue
+            score = 2 * len(target_grams & self.gram_sets[position]) / (len(target_grams) + len(self.gram_sets[position]))
+            if target in candidate or candidate in target:
+                ranked.append((0, -score, position, 'substring',
+                               f"'{target}' dan '{candidate}' saling memuat (kemiripan {score:.2f})"))
+            elif score >= HSH_MATCH_MIN_SCORE:
+                ranked.append((1, -score, position, 'ngram',
+                               f"Kemiripan trigram '{target}' dengan '{candidate}' = {score:.2f}"))
+        ranked.sort()
+        return [HSHMatch(self.values[position], position, -neg_score, method, reason)
+                for _, neg_score, position, method, reason in ranked[:limit]]
+
+    def match(self, target_hsh):
+        found = self.candidates(target_hsh, limit=1)
+        return found[0] if found else None
+
+    def default_match(self):
+        if self.default_position is None:
+            return None
+        return HSHMatch(self.values[self.default_position], self.default_position, 0.0, 'default',
+                        f"Tidak ada HSH yang cocok, memakai benchmark default '{self.normalized[self.default_position]}'")
+
+# Matcher di-cache per isi kolom HSH sehingga indeks hanya dibangun sekali per dataset
+@st.cache_resource(show_spinner=False)
+def get_hsh_matcher(hsh_normalized):
+    return HSHMatcher(hsh_normalized)
+
+# Workbook dan sheet sumber untuk setiap dataset, sesuai urutan hasil load_excel_files
+EXCEL_SOURCES = {
+    'skor_total': ('documents/SKOR_TOTAL_ALL.xlsx', 'SKOR TOTAL_ALL'),
+    'skor_survei': ('documents/Skor_SURVEI_ALL.xlsx', 'Skor_SURVEI_ALL_FUNGSI'),
+    'skor_benchmark_evidence': ('documents/Skor_benchmark.xlsx', 'Evidence'),
+    'skor_benchmark_survei': ('documents/Skor_benchmark.xlsx', 'Survei')
+}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Kolom HSH_normalized: sheet skor memakai kolom 'HSH', sheet benchmark memakai kolom pertama
+def add_normalized_hsh(name, df):
+    if name.startswith('skor_benchmark'):
+        df['HSH_normalized'] = df.iloc[:, 0].apply(normalize_hsh)
+    elif 'HSH' in df.columns:
+        df['HSH_normalized'] = df['HSH'].apply(normalize_hsh)
+    return df
+
+def read_excel_sheet(name):
+    path, sheet = EXCEL_SOURCES[name]
+    return add_normalized_hsh(name, pd.read_excel(path, sheet_name=sheet))
+
+# Membaca snapshot Arrow (memory-mapped) jika masih sesuai dengan workbook sumbernya.
+# Validitas dicek dari mtime+ukuran; jika mtime berubah tapi isi sama (hash identik), snapshot tetap dipakai.
+def load_snapshot(name, source_stat, source_hash=None):
+    snapshot_path = os.path.join(SNAPSHOT_DIR, f"{name}.arrow")
+    if not os.path.exists(snapshot_path):
+        return None, None
+    with pa.memory_map(snapshot_path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        meta = json.loads((reader.schema.metadata or {}).get(b'rapport', b'{}'))
+        if meta.get('version') != SNAPSHOT_VERSION or meta.get('sheet') != EXCEL_SOURCES[name][1]:
+            return None, meta
+        if meta.get('size') != source_stat.st_size:
+            return None, meta
+        if meta.get('mtime_ns') != source_stat.st_mtime_ns and meta.get('sha256') != source_hash:
+            return None, meta
+        return reader.read_all().to_pandas(), meta
+
+def write_snapshot(name, df, source_stat, source_hash):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    table = pa.Table.from_pandas(df)
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'sheet': EXCEL_SOURCES[name][1],
+        'size': source_stat.st_size,
+        'mtime_ns': source_stat.st_mtime_ns,
+        'sha256': source_hash
+    }
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'rapport': json.dumps(meta).encode()})
+    snapshot_path = os.path.join(SNAPSHOT_DIR, f"{name}.arrow")
+    # Tulis ke file sementara lalu rename agar proses lain tidak membaca snapshot setengah jadi
+    tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, snapshot_path)
+
+def read_sheet(name):
+    if feather is None or not SNAPSHOT_ENABLED:
+        return read_excel_sheet(name)
+
+    path = EXCEL_SOURCES[name][0]
+    source_stat = os.stat(path)
+    try:
+        df, meta = load_snapshot(name, source_stat)
+        if df is None and meta and meta.get('size') == source_stat.st_size:
+            # mtime berubah (mis. file disalin ulang): bandingkan hash isi sebelum parse ulang
+            source_hash = file_sha256(path)
+            df, meta = load_snapshot(name, source_stat, source_hash)
+            if df is not None:
+                write_snapshot(name, df, source_stat, source_hash)
+        if df is not None:
+            return df
+    except (OSError, ValueError, pa.ArrowException):
+        pass  # Snapshot rusak atau tidak terbaca: parse ulang dari workbook
+
+    df = read_excel_sheet(name)
+    try:
+        write_snapshot(name, df, source_stat, file_sha256(path))
+    except (OSError, ValueError, TypeError, pa.ArrowException):
+        pass  # Kolom bertipe campuran tidak bisa dikonversi ke Arrow; tetap pakai hasil parse Excel
+    return df
+
+# Kolom teks yang selalu disimpan sebagai categorical; kolom teks lain ikut jika nilai uniknya sedikit
+CATEGORICAL_COLUMNS = ('HSH', 'Fungsi', 'HSH_normalized')
+
+# Memadatkan dtype tanpa mengubah nilai: teks berulang -> category, integer -> int16/int32,
+# float -> float32 hanya jika lossless (nilai skor dipakai apa adanya di prompt)
+def compact_frame(df):
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            downcast = pd.to_numeric(values, downcast='integer')
+            df[column] = downcast if downcast.dtype.itemsize >= 2 else downcast.astype(np.int16)
+        elif pd.api.types.is_float_dtype(values):
+            downcast = values.astype(np.float32)
+            if np.array_equal(downcast.to_numpy(dtype=np.float64), values.to_numpy(), equal_nan=True):
+                df[column] = downcast
+        elif pd.api.types.is_string_dtype(values) and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+            if column in CATEGORICAL_COLUMNS or values.nunique() <= len(values) // 2:
+                df[column] = values.astype('category')
+    return df
+
+# Indeks pilihan HSH/Fungsi dari sheet skor total, dibangun sekali saat load:
+# daftar HSH terurut, HSH -> daftar Fungsi terurut, dan pasangan (HSH, Fungsi) sesuai urutan workbook
+class ScoringIndex:
+    def __init__(self, skor_total):
+        pairs = skor_total[['HSH', 'Fungsi']].dropna().astype(object).drop_duplicates()
+        self.pairs = list(pairs.itertuples(index=False, name=None))
+        fungsi_by_hsh = {}
+        for hsh, fungsi in self.pairs:
+            fungsi_by_hsh.setdefault(hsh, []).append(fungsi)
+        self.hsh_list = sorted(fungsi_by_hsh)
+        self.fungsi_by_hsh = {hsh: sorted(fungsi_list) for hsh, fungsi_list in fungsi_by_hsh.items()}
+
+    def fungsi_for(self, hsh):
+        return self.fungsi_by_hsh.get(hsh, [])
+
+# Repositori data skor read-only: dimuat sekali per proses dan dipakai bersama oleh semua sesi.
+# Frame tidak boleh dimodifikasi pemanggil (turunan dibuat dengan copy/assign).
+class ScoringData:
+    def __init__(self, frames):
+        self.original_bytes = {name: int(df.memory_usage(deep=True).sum()) for name, df in frames.items()}
+        self.frames = {name: compact_frame(df) for name, df in frames.items()}
+        self.index = ScoringIndex(self.frames['skor_total'])
+        # Tabel perbandingan ber-index Fungsi (Fungsi -> baris) untuk setiap pasangan sheet skor/benchmark
+        self.comparisons = {
+            kind: build_comparison_frame(self.frames[scores], self.frames[benchmark], fungsi_columns, benchmark_columns)
+            for kind, (scores, benchmark, fungsi_columns, benchmark_columns) in COMPARISON_SOURCES.items()
+        }
+
+    def as_tuple(self):
+        return tuple(self.frames[name] for name in EXCEL_SOURCES)
+
+    # Tabel perbandingan siap pakai jika kedua frame adalah milik repositori ini (cek identitas, tanpa hashing)
+    def comparison_for(self, kind, scores, benchmark):
+        scores_name, benchmark_name = COMPARISON_SOURCES[kind][:2]
+        if scores is self.frames[scores_name] and benchmark is self.frames[benchmark_name]:
+            return self.comparisons[kind]
+        return None
+
+    def memory_footprint(self):
+        return pd.DataFrame([
+            {
+                'Dataset': name,
+                'Baris': len(df),
+                'Kolom': df.shape[1],
+                'Memori Awal (KB)': round(self.original_bytes[name] / 1024, 1),
+                'Memori (KB)': round(df.memory_usage(deep=True).sum() / 1024, 1)
+            }
+            for name, df in self.frames.items()
+        ])
+
+    def total_bytes(self):
+        return int(sum(df.memory_usage(deep=True).sum() for df in self.frames.values()))
+
+@st.cache_resource(show_spinner=False)
+def get_scoring_data():
+    return ScoringData({name: read_sheet(name) for name in EXCEL_SOURCES})
 
-@st.cache_data
 def load_excel_files():
     try:
-        skor_total = pd.read_excel('documents/SKOR_TOTAL_ALL.xlsx', sheet_name='SKOR TOTAL_ALL')
-        skor_survei = pd.read_excel('documents/Skor_SURVEI_ALL.xlsx', sheet_name='Skor_SURVEI_ALL_FUNGSI')
-        skor_benchmark_evidence = pd.read_excel('documents/Skor_benchmark.xlsx', sheet_name='Evidence')
-        skor_benchmark_survei = pd.read_excel('documents/Skor_benchmark.xlsx', sheet_name='Survei')
-        
-        if 'HSH' in skor_total.columns:
-            skor_total['HSH_normalized'] = skor_total['HSH'].apply(normalize_hsh)
-        if 'HSH' in skor_survei.columns:
-            skor_survei['HSH_normalized'] = skor_survei['HSH'].apply(normalize_hsh)
-        
-        skor_benchmark_evidence['HSH_normalized'] = skor_benchmark_evidence.iloc[:, 0].apply(normalize_hsh)
-        skor_benchmark_survei['HSH_normalized'] = skor_benchmark_survei.iloc[:, 0].apply(normalize_hsh)
-        
-        return skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei
+        return get_scoring_data().as_tuple()
     except Exception as e:
         st.error(f"Error loading Excel files: {str(e)}")
         st.info("Pastikan folder 'documents' ada dan berisi file: SKOR_TOTAL_ALL.xlsx, Skor_SURVEI_ALL.xlsx, dan Skor_benchmark.xlsx")
         return None, None, None, None
 
-def extract_text_from_pdf(pdf_file):
+# Generator teks PDF per halaman; halaman berikutnya tidak di-parse setelah max_chars tercapai
+def iter_pdf_pages(pdf_file, max_chars=None):
+    pdf_reader = PyPDF2.PdfReader(pdf_file)
+    total = 0
+    for page in pdf_reader.pages:
+        text = (page.extract_text() or "") + "\n"
+        if max_chars is not None and total + len(text) >= max_chars:
+            yield text[:max_chars - total]
+            return
+        total += len(text)
+        yield text
+
+# Dijalankan di worker process: ekstraksi satu rentang halaman dari bytes PDF
+def extract_pdf_page_range(pdf_bytes, start, stop):
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    return [(pdf_reader.pages[i].extract_text() or "") + "\n" for i in range(start, stop)]
+
+# Hanya untuk teks lengkap (max_chars=None): dengan batas karakter, iter_pdf_pages yang berhenti lebih awal
+# lebih murah daripada mengirim seluruh bytes PDF ke tiap worker
+def extract_pdf_text_parallel(pdf_file):
+    pdf_file.seek(0)
+    pdf_bytes = pdf_file.read()
+    page_count = len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        pdf_file.seek(0)
+        return None
+    workers = max(1, min(PDF_PROCESS_WORKERS, page_count))
+    step = -(-page_count // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(extract_pdf_page_range, pdf_bytes, start, min(start + step, page_count))
+                   for start in range(0, page_count, step)]
+        return "".join(text for future in futures for text in future.result())
+
+def extract_text_from_pdf(pdf_file, max_chars=None):
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        if max_chars is None and PDF_PARALLEL:
+            text = extract_pdf_text_parallel(pdf_file)
+            if text is not None:
+                return text
+        return "".join(iter_pdf_pages(pdf_file, max_chars))
     except Exception as e:
         return f"Error reading PDF: {str(e)}"
 
+# Threshold Otsu dari histogram grayscale untuk binarisasi
+def otsu_threshold(gray):
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = gray.size - weight_bg
+    sum_bg = np.cumsum(levels * hist)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    return int(np.argmax(weight_bg * weight_fg * (mean_bg - mean_fg) ** 2))
+
+# Orientasi EXIF, grayscale, perkecil ke DPI target (atau sisi terpanjang maksimum), lalu binarisasi
+def preprocess_for_ocr(image):
+    image = ImageOps.exif_transpose(image)
+    gray = image.convert('L')
+    dpi = image.info.get('dpi', (0, 0))[0] or 0
+    scale = OCR_TARGET_DPI / float(dpi) if dpi and dpi > OCR_TARGET_DPI else 1.0
+    longest = max(gray.size) * scale
+    if longest > OCR_MAX_SIDE:
+        scale *= OCR_MAX_SIDE / longest
+    if scale < 1.0:
+        gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))), Image.LANCZOS)
+    pixels = np.asarray(gray)
+    return np.where(pixels > otsu_threshold(pixels), 255, 0).astype(np.uint8)
+
+# Potong gambar tinggi menjadi tile horizontal; potongan dipilih di baris kosong agar tidak membelah teks
+def split_into_tiles(binary):
+    height = binary.shape[0]
+    if height <= OCR_TILE_HEIGHT:
+        return [binary]
+    blank_rows = binary.min(axis=1) == 255
+    tiles = []
+    start = 0
+    while height - start > OCR_TILE_HEIGHT:
+        window_start = start + OCR_TILE_HEIGHT // 2
+        blanks = np.flatnonzero(blank_rows[window_start:start + OCR_TILE_HEIGHT])
+        cut = window_start + blanks[-1] if len(blanks) else start + OCR_TILE_HEIGHT
+        tiles.append(binary[start:cut])
+        start = cut
+    tiles.append(binary[start:])
+    return tiles
+
+def ocr_tile(tile):
+    return pytesseract.image_to_string(Image.fromarray(tile), lang=OCR_LANG, config=f'--dpi {OCR_TARGET_DPI}')
+
+OCRResult = namedtuple('OCRResult', ['text', 'frames', 'tiles', 'seconds', 'cached'])
+
+# Cache LRU hasil OCR per hash isi gambar, dipakai bersama semua sesi dalam satu proses
+class OCRCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource(show_spinner=False)
+def get_ocr_cache():
+    return OCRCache(OCR_CACHE_MAX_ENTRIES)
+
+# OCR semua frame (mis. TIFF multi-halaman) dan tile secara paralel. pytesseract menjalankan proses
+# tesseract terpisah untuk tiap tile, sehingga thread pool sudah memakai banyak core tanpa process pool.
+def ocr_image_bytes(image_bytes):
+    started = time.perf_counter()
+    cache_key = f"{hashlib.sha256(image_bytes).hexdigest()}:{OCR_LANG}:{OCR_TARGET_DPI}:{OCR_MAX_SIDE}:{OCR_TILE_HEIGHT}"
+    ocr_cache = get_ocr_cache()
+    cached = ocr_cache.get(cache_key)
+    if cached is not None:
+        return cached._replace(seconds=time.perf_counter() - started, cached=True)
+
+    image = Image.open(io.BytesIO(image_bytes))
+    frame_tiles = [split_into_tiles(preprocess_for_ocr(frame.copy())) for frame in ImageSequence.Iterator(image)]
+    tiles = [tile for frame in frame_tiles for tile in frame]
+    with ThreadPoolExecutor(max_workers=max(1, min(OCR_WORKERS, len(tiles))), thread_name_prefix="rapport-ocr") as executor:
+        tile_texts = iter(list(executor.map(ocr_tile, tiles)))
+    text = "\n\n".join("\n".join(next(tile_texts) for _ in frame) for frame in frame_tiles)
+
+    result = OCRResult(text, len(frame_tiles), len(tiles), time.perf_counter() - started, False)
+    ocr_cache.set(cache_key, result)
+    return result
+
 def extract_text_from_image(image_file):
     try:
-        image = Image.open(image_file)
-        text = pytesseract.image_to_string(image, lang='ind+eng')
-        return text
+        result = ocr_image_bytes(image_file.read())
+        notify(
+            'caption',
+            f"🖼️ OCR {os.path.basename(getattr(image_file, 'name', 'gambar'))}: {result.frames} halaman, "
+            f"{result.tiles} tile, {result.seconds:.1f} detik" + (" (dari cache)" if result.cached else "")
+        )
+        return result.text
     except Exception as e:
         return f"Error reading image: {str(e)}"
 
-def read_uploaded_file(uploaded_file):
+def format_excel_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(round(value, 4))
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d') if value.time() == datetime.min.time() else value.isoformat(sep=' ')
+    return ' '.join(str(value).split())
+
+# Serialisasi satu sheet: baris header selalu disertakan, baris kosong dan sel kosong di ujung dibuang,
+# berhenti saat budget karakter habis (atau mengambil sampel tiap n baris jika sample_rows aktif)
+def serialize_excel_sheet(worksheet, budget=None, sample_rows=False):
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    out.write(f"## Sheet: {worksheet.title}\n")
+    header_seen = False
+    data_rows = 0
+    stride = 1
+    probe_chars = 0
+    for row in worksheet.iter_rows(values_only=True):
+        cells = [format_excel_cell(value) for value in row]
+        while cells and not cells[-1]:
+            cells.pop()
+        if not cells:
+            continue
+        if header_seen:
+            data_rows += 1
+            if sample_rows and data_rows == EXCEL_SAMPLING_PROBE_ROWS and budget is not None and worksheet.max_row:
+                # Perkirakan berapa baris muat dalam sisa budget, lalu tentukan jarak sampel
+                average = max(1, probe_chars / EXCEL_SAMPLING_PROBE_ROWS)
+                rows_fit = max(1, int((budget - out.tell() - 100) / average))
+                stride = max(1, math.ceil((worksheet.max_row - data_rows) / rows_fit))
+            if data_rows > EXCEL_SAMPLING_PROBE_ROWS and (data_rows - EXCEL_SAMPLING_PROBE_ROWS) % stride:
+                continue
+        position = out.tell()
+        writer.writerow(cells)
+        if header_seen and data_rows <= EXCEL_SAMPLING_PROBE_ROWS:
+            probe_chars += out.tell() - position
+        header_seen = True
+        if budget is not None and out.tell() >= budget:
+            break
+    note = f"(sampel: setiap {stride} baris dari sekitar {worksheet.max_row} baris)\n" if stride > 1 else ""
+    text = out.getvalue()
+    if budget is not None:
+        text = text[:max(0, budget - len(note))]
+        if note and not text.endswith("\n"):
+            text = text[:text.rfind("\n") + 1]  # Buang baris yang terpotong sebelum catatan sampel
+    return text + note
+
+def serialize_excel_compact(excel_file, max_chars=None, sample_rows=False):
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        worksheets = workbook.worksheets
+        parts = []
+        used = 0
+        for index, worksheet in enumerate(worksheets):
+            budget = None
+            if max_chars is not None:
+                remaining = max_chars - used
+                if remaining <= 0:
+                    break
+                # Sisa budget dibagi rata ke sheet yang belum dibaca; sisa yang tak terpakai diteruskan
+                budget = remaining // (len(worksheets) - index)
+            text = serialize_excel_sheet(worksheet, budget, sample_rows)
+            parts.append(text)
+            used += len(text)
+        return "".join(parts)
+    finally:
+        workbook.close()
+
+# Format .xls lama tidak didukung openpyxl: baca semua sheet dengan pandas lalu serialisasi ke CSV
+def serialize_xls(excel_file, max_chars=None):
+    parts = []
+    for sheet_name, df in pd.read_excel(excel_file, sheet_name=None).items():
+        parts.append(f"## Sheet: {sheet_name}\n" + df.dropna(how='all').to_csv(index=False))
+    return "".join(parts)[:max_chars]
+
+# Cache hasil ekstraksi upload (PDF/OCR/Excel) berdasarkan hash isi file dan pengaturan ekstraksi.
+# Lapisan memori LRU dibagi semua sesi; jika upload_cache_persist aktif, disalin juga ke SQLite di disk.
+class UploadCache:
+    def __init__(self, max_bytes, disk_cache=None):
+        self.max_bytes = max_bytes
+        self.disk_cache = disk_cache
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (teks, ukuran)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        if self.disk_cache is None:
+            return None
+        text = self.disk_cache.get(key, counter="upload_")
+        if text is not None:
+            self._remember(key, text)
+        return text
+
+    def set(self, key, text):
+        self._remember(key, text)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, text)
+
+    def _remember(self, key, text):
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (text, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+@st.cache_resource(show_spinner=False)
+def get_upload_cache():
+    disk_cache = None
+    if UPLOAD_CACHE_PERSIST:
+        try:
+            disk_cache = LLMResponseCache(UPLOAD_CACHE_PATH, UPLOAD_CACHE_DISK_MAX_MB * 1024 * 1024,
+                                          UPLOAD_CACHE_MAX_AGE_DAYS * 86400, table="uploads")
+        except (sqlite3.Error, OSError) as e:
+            notify('warning', f"⚠️ Cache upload di disk tidak dapat dibuka, hanya memakai memori: {str(e)}")
+    return UploadCache(UPLOAD_CACHE_MAX_MB * 1024 * 1024, disk_cache)
+
+# Versi parser upload; naikkan jika cara ekstraksi berubah agar hasil lama di cache tidak dipakai
+UPLOAD_PARSER_VERSION = "1"
+
+# Kunci cache upload: hash isi file, ekstensi, batas karakter, dan pengaturan yang mempengaruhi hasil
+def upload_cache_key(content, file_extension, max_chars):
+    if file_extension == 'xlsx':
+        settings = [EXCEL_ROW_SAMPLING, EXCEL_SAMPLING_PROBE_ROWS]
+    elif file_extension in ['png', 'jpg', 'jpeg', 'tif', 'tiff']:
+        settings = [OCR_LANG, OCR_TARGET_DPI, OCR_MAX_SIDE, OCR_TILE_HEIGHT]
+    else:
+        settings = []
+    return get_content_hash(json.dumps([
+        UPLOAD_PARSER_VERSION, hashlib.sha256(content).hexdigest(), file_extension, max_chars, settings
+    ]))
+
+# max_chars: batas karakter hasil (None = teks lengkap)
+@traced("read_uploaded_file")
+def read_uploaded_file(uploaded_file, max_chars=None):
     if uploaded_file is None:
         return None
     
     file_extension = uploaded_file.name.split('.')[-1].lower()
-    
+
+    # File yang sama (isi identik) tidak diparse ulang, termasuk lintas sesi
+    content = uploaded_file.getvalue() if hasattr(uploaded_file, 'getvalue') else uploaded_file.read()
+    upload_cache = get_upload_cache()
+    cache_key = upload_cache_key(content, file_extension, max_chars)
+    cached = upload_cache.get(cache_key)
+    annotate_span(extension=file_extension, upload_bytes=len(content), upload_cache_hit=cached is not None)
+    if cached is not None:
+        return cached
+
+    text = extract_upload_text(io.BytesIO(content), uploaded_file.name, file_extension, max_chars)
+    if not is_error_response(text) and text != "Format file tidak didukung":
+        upload_cache.set(cache_key, text)
+    return text
+
+def extract_upload_text(file, name, file_extension, max_chars=None):
+    file.name = name
     try:
-        if file_extension in ['xlsx', 'xls']:
-            df = pd.read_excel(uploaded_file)
-            return df.to_string()
+        if file_extension == 'xlsx':
+            return serialize_excel_compact(file, max_chars=max_chars, sample_rows=EXCEL_ROW_SAMPLING)
+        elif file_extension == 'xls':
+            return serialize_xls(file, max_chars=max_chars)
         elif file_extension == 'pdf':
-            return extract_text_from_pdf(uploaded_file)
-        elif file_extension in ['png', 'jpg', 'jpeg']:
-            return extract_text_from_image(uploaded_file)
+            return extract_text_from_pdf(file, max_chars=max_chars)
+        elif file_extension in ['png', 'jpg', 'jpeg', 'tif', 'tiff']:
+            return extract_text_from_image(file)[:max_chars]
         else:
             return "Format file tidak didukung"
     except Exception as e:
@@ -113,14 +963,349 @@ def get_content_hash(content):
         return "empty"
     return hashlib.md5(str(content).encode()).hexdigest()
 
+# Respons call_deepseek yang diawali teks ini adalah pesan error, bukan hasil analisis
+API_ERROR_PREFIXES = ("Error", "Gagal menghubungi API")
+
+def is_error_response(text):
+    return not text or str(text).startswith(API_ERROR_PREFIXES)
+
+# Kunci cache respons LLM berdasarkan seluruh parameter yang mempengaruhi output
+def build_llm_cache_key(model, system_prompt, prompt, temperature, max_tokens):
+    return get_content_hash(json.dumps({
+        "model": model,
+        "system": system_prompt,
+        "prompt": prompt,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }, sort_keys=True, ensure_ascii=False))
+
+# Cache respons LLM di SQLite (mode WAL) sehingga aman dipakai banyak sesi Streamlit dan banyak proses.
+# table: nama tabel entri, agar cache lain (mis. hasil ekstraksi upload) punya namespace sendiri
+class LLMResponseCache:
+    # Eviction (DELETE dengan window function atas seluruh tabel) hanya dijalankan setiap EVICT_EVERY_WRITES
+    # penulisan atau setelah data yang ditulis sejak eviction terakhir melebihi EVICT_WRITE_FRACTION dari batas
+    EVICT_EVERY_WRITES = 100
+    EVICT_WRITE_FRACTION = 0.05
+
+    def __init__(self, path, max_bytes, max_age_seconds, table="responses"):
+        self.path = path
+        self.table = table
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._bytes_since_evict = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.table} (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL)""")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_accessed ON {self.table}(accessed_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.evict(conn)
+
+    # Satu koneksi per thread; sqlite3 tidak mengizinkan koneksi dipakai lintas thread
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn, name):
+        conn.execute(
+            "INSERT INTO stats(name, value) VALUES(?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    # counter: awalan nama statistik, agar pemakai lain tabel ini (mis. hasil bagian) tidak tercampur
+    # dengan hit/miss respons LLM
+    def get(self, key, counter=""):
+        try:
+            conn = self._connect()
+            row = conn.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age_seconds:
+                if row is not None:
+                    conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._count(conn, f"{counter}misses")
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self._count(conn, f"{counter}hits")
+            return row[0]
+        except sqlite3.Error:
+            return None
+
+    def set(self, key, value):
+        try:
+            conn = self._connect()
+            now = time.time()
+            size = len(value.encode('utf-8'))
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table}(key, value, size, created_at, accessed_at) VALUES(?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            if self._should_evict(size):
+                self.evict(conn)
+        except sqlite3.Error:
+            pass
+
+    def _should_evict(self, size):
+        with self._evict_lock:
+            self._writes_since_evict += 1
+            self._bytes_since_evict += size
+            if (self._writes_since_evict < self.EVICT_EVERY_WRITES
+                    and self._bytes_since_evict < self.max_bytes * self.EVICT_WRITE_FRACTION):
+                return False
+            self._writes_since_evict = self._bytes_since_evict = 0
+            return True
+
+    # Hapus entri kedaluwarsa, lalu entri yang paling lama tidak diakses sampai total ukuran di bawah batas
+    def evict(self, conn=None):
+        conn = conn or self._connect()
+        conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+        conn.execute(f"""DELETE FROM {self.table} WHERE key IN (
+            SELECT key FROM (
+                SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS running_size FROM {self.table}
+            ) WHERE running_size > ?)""", (self.max_bytes,))
+
+    def stats(self):
+        try:
+            conn = self._connect()
+            counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, total_size = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        except sqlite3.Error:
+            return {"hits": 0, "misses": 0, "entries": 0, "bytes": 0, "hit_rate": 0.0}
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": entries,
+            "bytes": total_size,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_llm_cache():
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        return LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_MAX_AGE_DAYS * 86400)
+    except (sqlite3.Error, OSError) as e:
+        notify('warning', f"⚠️ Cache LLM tidak dapat dibuka, melanjutkan tanpa cache: {str(e)}")
+        return None
+
+# Statistik untuk sidebar: COUNT/SUM atas seluruh tabel cukup dihitung sekali per LLM_CACHE_STATS_TTL,
+# bukan pada setiap rerun (mis. setiap JOB_POLL_INTERVAL selama job berjalan)
+@st.cache_data(show_spinner=False, ttl=LLM_CACHE_STATS_TTL)
+def get_llm_cache_stats():
+    llm_cache = get_llm_cache()
+    return llm_cache.stats() if llm_cache is not None else None
+
+# Client HTTP DeepSeek dengan session ber-pool (keep-alive) yang dipakai bersama semua analisis
+class DeepSeekClient:
+    def __init__(self, api_key, base_url=DEEPSEEK_BASE_URL, pool_size=HTTP_POOL_SIZE,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        # Retry ditangani call_deepseek, jadi adapter tidak mengulang request sendiri
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        })
+
+    def chat_completions(self, payload, read_timeout=60, stream=False):
+        return self.session.post(
+            f"{self.base_url}/chat/completions",
+            json=payload,
+            timeout=(self.connect_timeout, read_timeout),
+            stream=stream
+        )
+
+    def close(self):
+        self.session.close()
+
+@st.cache_resource(show_spinner=False)
+def get_deepseek_client():
+    return DeepSeekClient(DEEPSEEK_API_KEY)
+
+# Token bucket untuk request dan token per menit, dipakai bersama oleh semua sesi dan thread.
+# Sinyal 429 menahan semua pemanggil sampai Retry-After dan menurunkan laju (naik kembali perlahan saat sukses).
+class RateLimiter:
+    MIN_RATE_SCALE = 0.1
+
+    def __init__(self, requests_per_minute, tokens_per_minute=0, burst_seconds=10.0):
+        self.request_rate = requests_per_minute / 60.0
+        self.token_rate = tokens_per_minute / 60.0
+        self.request_capacity = max(1.0, self.request_rate * burst_seconds)
+        self.token_capacity = max(1.0, self.token_rate * burst_seconds)
+        self.request_level = self.request_capacity
+        self.token_level = self.token_capacity
+        self.rate_scale = 1.0
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self.request_level = min(self.request_capacity, self.request_level + elapsed * self.request_rate * self.rate_scale)
+        self.token_level = min(self.token_capacity, self.token_level + elapsed * self.token_rate * self.rate_scale)
+
+    # Menunggu sampai jatah tersedia; mengembalikan lama menunggu (detik)
+    def acquire(self, tokens=0):
+        started = time.monotonic()
+        # Permintaan yang lebih besar dari kapasitas bucket dibatasi agar tidak menunggu selamanya
+        tokens = min(tokens, self.token_capacity) if self.token_rate else 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    request_missing = 1 - self.request_level if self.request_rate else 0
+                    token_missing = tokens - self.token_level if self.token_rate else 0
+                    if request_missing <= 0 and token_missing <= 0:
+                        if self.request_rate:
+                            self.request_level -= 1
+                        if self.token_rate:
+                            self.token_level -= tokens
+                        return now - started
+                    wait = max(request_missing / (self.request_rate * self.rate_scale) if request_missing > 0 else 0,
+                               token_missing / (self.token_rate * self.rate_scale) if token_missing > 0 else 0)
+            time.sleep(min(wait, 1.0))
+
+    # Koreksi jatah token setelah pemakaian sebenarnya diketahui dari respons
+    def settle(self, estimated_tokens, actual_tokens):
+        if not self.token_rate or actual_tokens is None:
+            return
+        with self._lock:
+            self.token_level = min(self.token_capacity, self.token_level + estimated_tokens - actual_tokens)
+
+    def on_rate_limited(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = rate_limit_delay(retry_after)
+            self.blocked_until = max(self.blocked_until, now + delay)
+            self.rate_scale = max(self.MIN_RATE_SCALE, self.rate_scale / 2)
+            self.request_level = min(self.request_level, 0.0)
+
+    def on_success(self):
+        with self._lock:
+            self.rate_scale = min(1.0, self.rate_scale + 0.05)
+
+# Circuit breaker: setelah beberapa kegagalan beruntun (5xx/timeout) semua panggilan langsung gagal
+# selama reset_seconds, lalu satu panggilan percobaan menentukan apakah layanan sudah pulih
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if self.state == 'open' and now - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self._probe_started = None
+            # Hanya satu panggilan percobaan; jika hasilnya tidak pernah dilaporkan, percobaan baru diizinkan
+            if self.state == 'half_open' and (self._probe_started is None or now - self._probe_started >= self.reset_seconds):
+                self._probe_started = now
+                return True
+            return False
+
+    def retry_in(self):
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._probe_started = None
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter():
+    return RateLimiter(API_REQUESTS_PER_MINUTE, API_TOKENS_PER_MINUTE, API_BURST_SECONDS)
+
+@st.cache_resource(show_spinner=False)
+def get_circuit_breaker():
+    return CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+# Header Retry-After bisa berupa jumlah detik atau tanggal HTTP
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# Lama penahanan setelah 429: Retry-After dari server (atau default), dibatasi RATE_LIMIT_MAX_BACKOFF
+def rate_limit_delay(retry_after):
+    delay = retry_after if retry_after is not None else API_RETRY_AFTER_DEFAULT
+    return min(delay, RATE_LIMIT_MAX_BACKOFF)
+
+# Membaca respons server-sent events DeepSeek (stream: true) dan menghasilkan potongan teks satu per satu
+def iter_sse_tokens(response, usage=None):
+    response.encoding = 'utf-8'  # text/event-stream tanpa charset akan dianggap latin-1 oleh requests
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
+        try:
+            chunk = json.loads(payload)
+        except json.JSONDecodeError:
+            continue
+        if usage is not None and chunk.get('usage'):
+            usage.update(chunk['usage'])
+        choices = chunk.get('choices') or []
+        if choices:
+            token = (choices[0].get('delta') or {}).get('content')
+            if token:
+                yield token
+
 # Fungsi untuk memanggil DeepSeek API dengan retry mechanism yang diperkuat
-def call_deepseek(prompt, max_tokens=1000, max_retries=3, timeout=60):
-    """Memanggil DeepSeek API dengan retry mechanism yang diperkuat untuk handle connection errors"""
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+@traced("call_deepseek")
+def call_deepseek(prompt, max_tokens=1000, max_retries=3, timeout=60, use_cache=True, client=None, on_token=None,
+                  json_mode=False):
+    """Memanggil DeepSeek API dengan retry mechanism yang diperkuat untuk handle connection errors.
+    Jika on_token diberikan, respons di-stream dan on_token(teks_sejauh_ini) dipanggil selama token diterima.
+    json_mode=True meminta respons berupa objek JSON (response_format json_object)."""
+    client = client or get_deepseek_client()
     
     # System prompt yang lebih ringkas untuk mengurangi ukuran request
     system_prompt = """Anda adalah konsultan senior budaya kerja perusahaan. Berikan analisis apresiatif dengan reasoning lengkap. Fokus pada aspek PERILAKU: perubahan mindset, kolaborasi, komunikasi, kepemimpinan, keterlibatan. Gunakan bahasa profesional, hangat, dan menghargai. Setiap poin harus memiliki reasoning yang jelas."""
@@ -140,6 +1325,11 @@ def call_deepseek(prompt, max_tokens=1000, max_retries=3, timeout=60):
         "temperature": 0.3,
         "max_tokens": max_tokens
     }
+    if on_token is not None:
+        data["stream"] = True
+        data["stream_options"] = {"include_usage": True}
+    if json_mode:
+        data["response_format"] = {"type": "json_object"}
     
     # Coba format JSON untuk memastikan validitas
     try:
@@ -147,30 +1337,88 @@ def call_deepseek(prompt, max_tokens=1000, max_retries=3, timeout=60):
     except Exception as e:
         return f"Error: Data tidak valid untuk API - {str(e)}"
     
+    # Respons untuk input yang sama persis diambil dari cache tanpa memanggil API
+    llm_cache = get_llm_cache() if use_cache else None
+    cache_key = None
+    if llm_cache is not None:
+        cache_key = build_llm_cache_key(
+            data["model"], data["messages"][0]["content"], data["messages"][1]["content"],
+            data["temperature"], data["max_tokens"]
+        )
+        if json_mode:
+            cache_key = get_content_hash(f"json:{cache_key}")
+        cached = llm_cache.get(cache_key)
+        annotate_span(cache_hit=cached is not None)
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
+    
     last_error = None
+    limiter = get_rate_limiter()
+    breaker = get_circuit_breaker()
+    # Perkiraan kasar token (±4 karakter per token) untuk limiter; dikoreksi dengan usage dari respons
+    estimated_tokens = (len(system_prompt) + len(data["messages"][1]["content"])) // 4 + max_tokens
     
+    annotate_span(max_tokens=max_tokens, stream=on_token is not None, json_mode=json_mode)
+    # Pemakaian token dicatat pada span call_deepseek, termasuk saat respons streaming dibaca di span request
+    call_span = _current_span.get()
     for attempt in range(max_retries):
+        annotate_span(attempts=attempt + 1)
+        response = None
+        if not breaker.allow():
+            annotate_span(status='circuit_open')
+            return (f"Gagal menghubungi API: layanan DeepSeek sedang bermasalah, permintaan ditahan sementara "
+                    f"(coba lagi dalam {breaker.retry_in():.0f} detik)")
         try:
             # Tambahkan logging untuk debugging
             if attempt > 0:
-                st.info(f"⚠️ Percobaan ulang {attempt+1}/{max_retries} untuk koneksi API...")
+                notify('info', f"⚠️ Percobaan ulang {attempt+1}/{max_retries} untuk koneksi API...")
             
-            # Gunakan timeout yang lebih panjang
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=timeout
-            )
+            # Jatah rate limit diambil sebelum slot konkurensi agar menunggu tidak memblokir slot
+            throttled = limiter.acquire(estimated_tokens)
+            # Gunakan timeout yang lebih panjang; koneksi diambil dari pool client bersama
+            with _api_semaphore, span('deepseek.request', attempt=attempt + 1) as request_span:
+                response = client.chat_completions(data, read_timeout=timeout, stream=on_token is not None)
+                request_span.set(status_code=response.status_code, throttled_ms=round(throttled * 1000, 1))
+                if response.status_code == 200:
+                    limiter.on_success()
+                    breaker.record_success()
+                elif response.status_code >= 500:
+                    breaker.record_failure()
+                if response.status_code == 200 and on_token is not None:
+                    parts = []
+                    usage = {}
+                    last_update = 0.0
+                    for token in iter_sse_tokens(response, usage):
+                        parts.append(token)
+                        if time.monotonic() - last_update >= STREAM_UPDATE_INTERVAL:
+                            on_token("".join(parts))
+                            last_update = time.monotonic()
+                    content = "".join(parts)
+                    limiter.settle(estimated_tokens, usage.get('total_tokens'))
+                    if call_span is not None:
+                        call_span.set(prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'))
+                    if not content:
+                        return "Error: Respons streaming API kosong"
+                    on_token(content)
+                    if cache_key is not None and len(content) >= 50:
+                        llm_cache.set(cache_key, content)
+                    return content
             
             if response.status_code == 200:
                 try:
                     result = response.json()
+                    usage = result.get('usage') or {}
+                    limiter.settle(estimated_tokens, usage.get('total_tokens'))
+                    annotate_span(prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'))
                     if 'choices' in result and len(result['choices']) > 0:
                         content = result['choices'][0]['message']['content']
                         # Validasi panjang respons
                         if len(content) < 50:  # Jika respons terlalu pendek, mungkin tidak lengkap
-                            st.warning("⚠️ Respons API terlalu pendek, mungkin tidak lengkap")
+                            notify('warning', "⚠️ Respons API terlalu pendek, mungkin tidak lengkap")
+                        elif cache_key is not None and not is_error_response(content):
+                            llm_cache.set(cache_key, content)
                         return content
                     else:
                         return "Error: Format respons API tidak sesuai"
@@ -180,9 +1428,11 @@ def call_deepseek(prompt, max_tokens=1000, max_retries=3, timeout=60):
                     return f"Error: Struktur respons API tidak sesuai - {str(e)}"
             
             elif response.status_code == 429:  # Rate limit
-                wait_time = 2 ** attempt  # Exponential backoff
-                st.warning(f"⏳ Rate limit tercapai. Menunggu {wait_time} detik...")
-                time.sleep(wait_time)
+                # Limiter bersama menahan semua pemanggil sampai Retry-After, lalu melanjutkan dengan laju lebih rendah
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                limiter.on_rate_limited(retry_after)
+                last_error = "Rate limit (429)"
+                notify('warning', f"⏳ Rate limit tercapai. Permintaan ditahan {rate_limit_delay(retry_after):.0f} detik...")
                 continue
             
             elif response.status_code == 400:
@@ -201,34 +1451,42 @@ def call_deepseek(prompt, max_tokens=1000, max_retries=3, timeout=60):
                 
         except (Timeout, ConnectionError) as e:
             last_error = f"Koneksi timeout/terputus: {str(e)}"
+            breaker.record_failure()
             if attempt < max_retries - 1:
                 wait_time = 3 ** attempt  # Exponential backoff lebih agresif
-                st.warning(f"🔌 Koneksi terputus. Menunggu {wait_time} detik sebelum percobaan ulang...")
-                time.sleep(wait_time)
+                notify('warning', f"🔌 Koneksi terputus. Menunggu {wait_time} detik sebelum percobaan ulang...")
+                backoff_sleep(wait_time, 'timeout')
                 continue
         
         except requests.exceptions.RequestException as e:
             last_error = f"Error koneksi: {str(e)}"
             if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
+                backoff_sleep(2 ** attempt, 'request_error')
                 continue
         
         except Exception as e:
             last_error = f"Error tidak terduga: {str(e)}"
             if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
+                backoff_sleep(2 ** attempt, 'unexpected_error')
                 continue
+
+        finally:
+            # Respons streaming yang tidak dibaca habis (mis. 429 lalu continue) harus ditutup agar
+            # koneksinya kembali ke pool session
+            if response is not None:
+                response.close()
     
     # Jika semua percobaan gagal
     return f"Gagal menghubungi API setelah {max_retries} percobaan. Error terakhir: {last_error}"
 
 # Fungsi analisis dengan penanganan khusus untuk Impact
-def analyze_strategi_budaya(pcb_content, selected_hsh, selected_fungsi):
+@traced("analyze_strategi_budaya")
+def analyze_strategi_budaya(pcb_content, selected_hsh, selected_fungsi, on_token=None):
     prompt = f"""
 Analisis strategi budaya kerja untuk fungsi {selected_fungsi} di HSH {selected_hsh}.
 
 Data PCB:
-{pcb_content[:4000]}  # Batasi ukuran data
+{pcb_content[:PCB_CHAR_BUDGET]}  # Batasi ukuran data
 
 Fokus pada aspek PERILAKU dan berikan reasoning lengkap untuk setiap poin.
 
@@ -244,14 +1502,15 @@ Format output:
 - [Saran 1] - **Reasoning:** [Penjelasan singkat]
 - [Saran 2] - **Reasoning:** [Penjelasan singkat]
 """
-    return call_deepseek(prompt, max_tokens=1200, timeout=45)
+    return call_deepseek(prompt, max_tokens=1200, timeout=45, on_token=on_token)
 
-def analyze_program_budaya(pcb_content, selected_hsh, selected_fungsi):
+@traced("analyze_program_budaya")
+def analyze_program_budaya(pcb_content, selected_hsh, selected_fungsi, on_token=None):
     prompt = f"""
 Analisis Program Budaya untuk fungsi {selected_fungsi} di HSH {selected_hsh}.
 
 Data Program:
-{pcb_content[:4000]}  # Batasi ukuran data
+{pcb_content[:PCB_CHAR_BUDGET]}  # Batasi ukuran data
 
 Fokus pada dampak PERILAKU dan berikan reasoning untuk setiap evaluasi.
 
@@ -267,14 +1526,150 @@ Format output:
 - [Saran 1] - **Reasoning:** [Perbaikan perilaku]
 - [Saran 2] - **Reasoning:** [Perbaikan perilaku]
 """
-    return call_deepseek(prompt, max_tokens=1200, timeout=45)
+    return call_deepseek(prompt, max_tokens=1200, timeout=45, on_token=on_token)
+
+# Memotong teks menjadi bagian <= chunk_chars, sebisa mungkin di batas paragraf/baris
+def split_text_chunks(text, chunk_chars):
+    chunks = []
+    current = []
+    current_len = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > chunk_chars:  # Baris yang terlalu panjang dipotong paksa
+            if current:
+                chunks.append("".join(current))
+                current, current_len = [], 0
+            chunks.append(line[:chunk_chars])
+            line = line[chunk_chars:]
+        if current_len + len(line) > chunk_chars and current:
+            chunks.append("".join(current))
+            current, current_len = [], 0
+        current.append(line)
+        current_len += len(line)
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def summarize_impact_chunk(chunk, part, total_parts, selected_hsh, selected_fungsi, max_chars):
+    prompt = f"""
+Ringkas bagian {part}/{total_parts} dokumen Impact to Business fungsi {selected_fungsi} di HSH {selected_hsh}.
+
+Teks:
+{chunk}
+
+Tulis maksimal 5 poin singkat berisi program, perubahan PERILAKU, dan dampak bisnis (angka/capaian jika ada).
+Panjang ringkasan maksimal {max_chars} karakter. Jangan menambahkan informasi yang tidak ada di teks.
+"""
+    return call_deepseek(prompt, max_tokens=min(IMPACT_SUMMARY_MAX_TOKENS, max(64, max_chars // 2)), timeout=45)
+
+# Map-reduce: ringkas semua potongan secara paralel dengan jatah karakter per potongan, lalu ulangi pada
+# gabungan ringkasan sampai muat di IMPACT_CHAR_BUDGET. Hasil ringkasan tidak dipotong, sehingga
+# bagian akhir dokumen tetap terwakili. Potongan yang tetap gagal setelah dicoba ulang diganti kutipan
+# teks aslinya (sepanjang jatah) dengan nomor bagian yang sama; hasilnya ditandai FallbackResponse.
+def summarize_large_document(content, selected_hsh, selected_fungsi):
+    degraded = reduced = False
+    while len(content) > IMPACT_CHAR_BUDGET:
+        chunks = split_text_chunks(content, IMPACT_CHUNK_CHARS)
+        # Sisihkan ~30 karakter per potongan untuk penanda "[Bagian n]" / "[Bagian n, teks asli]" dan pemisah
+        max_chars = max(IMPACT_SUMMARY_MIN_CHARS, IMPACT_CHAR_BUDGET // len(chunks) - 30)
+        tasks = {
+            part: (summarize_impact_chunk, (chunk, part, len(chunks), selected_hsh, selected_fungsi, max_chars))
+            for part, chunk in enumerate(chunks, start=1)
+        }
+        summaries = run_concurrently(tasks, max_workers=IMPACT_MAP_WORKERS)
+        failed = [part for part in tasks if is_error_response(summaries[part])]
+        if failed:  # Satu kali percobaan ulang untuk potongan yang gagal
+            summaries.update(run_concurrently({part: tasks[part] for part in failed}, max_workers=IMPACT_MAP_WORKERS))
+            failed = [part for part in failed if is_error_response(summaries[part])]
+        if failed:
+            degraded = True
+            notify('warning', f"⚠️ Ringkasan Impact bagian {', '.join(map(str, failed))} dari {len(chunks)} gagal; "
+                              "memakai kutipan teks asli untuk bagian tersebut.")
+        summarized = "\n\n".join(
+            f"[Bagian {part}, teks asli] {chunks[part - 1][:max_chars].strip()}" if part in failed
+            else f"[Bagian {part}] {summaries[part].strip()}"
+            for part in sorted(tasks)
+        )
+        if len(summarized) >= len(content):
+            break  # Ringkasan tidak lagi memperpendek teks; pakai hasil putaran sebelumnya
+        content = summarized
+        reduced = True
+    if not reduced and len(content) > IMPACT_CHAR_BUDGET:
+        degraded = True
+        notify('warning', "⚠️ Dokumen Impact tidak dapat diringkas; hanya bagian awal yang dianalisis.")
+        content = content[:IMPACT_CHAR_BUDGET]
+    return FallbackResponse(content) if degraded else content
+
+# Mode gabungan: satu permintaan JSON berisi analisis Strategi dan Program Budaya.
+# Mengembalikan {'strategi_budaya': ..., 'program_budaya': ...} atau None jika respons tidak valid.
+@traced("analyze_pcb_combined")
+def analyze_pcb_combined(pcb_content, selected_hsh, selected_fungsi):
+    prompt = f"""
+Analisis strategi budaya kerja dan Program Budaya untuk fungsi {selected_fungsi} di HSH {selected_hsh}.
+
+Data PCB:
+{pcb_content[:PCB_CHAR_BUDGET]}
+
+Fokus pada aspek dan dampak PERILAKU, berikan reasoning lengkap untuk setiap poin.
+
+Jawab HANYA dengan objek JSON dengan dua key berisi teks markdown:
+{{"strategi_budaya": "...", "program_budaya": "..."}}
+
+Format teks markdown untuk masing-masing key:
+**Apresiasi Umum:**
+[1-2 kalimat apresiasi]
+
+**Hal yang Sudah Baik:**
+- [Poin/Program 1] - **Reasoning:** [Penjelasan singkat / dampak perilaku]
+- [Poin/Program 2] - **Reasoning:** [Penjelasan singkat / dampak perilaku]
+
+**Peluang Pengembangan:**
+- [Saran 1] - **Reasoning:** [Penjelasan singkat / perbaikan perilaku]
+- [Saran 2] - **Reasoning:** [Penjelasan singkat / perbaikan perilaku]
+"""
+    response = call_deepseek(prompt, max_tokens=2400, timeout=60, json_mode=True)
+    if is_error_response(response):
+        return None
+    try:
+        result = json.loads(response)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(result, dict):
+        return None
+    sections = {}
+    for key in ('strategi_budaya', 'program_budaya'):
+        text = result.get(key)
+        if not isinstance(text, str) or len(text.strip()) < 50:
+            return None
+        sections[key] = text.strip()
+    return sections
 
-def analyze_impact(impact_content, selected_hsh, selected_fungsi):
+# Strategi + Program Budaya dalam satu permintaan; jika JSON tidak valid, kembali ke dua permintaan terpisah
+def analyze_pcb_sections(pcb_content, selected_hsh, selected_fungsi, section_callbacks=None):
+    callbacks = section_callbacks or {}
+    for on_token in callbacks.values():
+        if on_token is not None:
+            on_token("⏳ Menganalisis Strategi dan Program Budaya dalam satu permintaan...")
+    sections = analyze_pcb_combined(pcb_content, selected_hsh, selected_fungsi)
+    if sections is not None:
+        return sections
+    notify('info', "💡 Respons gabungan PCB tidak valid, menganalisis Strategi dan Program Budaya secara terpisah...")
+    return run_concurrently({
+        'strategi_budaya': (analyze_strategi_budaya, (pcb_content, selected_hsh, selected_fungsi, callbacks.get('strategi_budaya'))),
+        'program_budaya': (analyze_program_budaya, (pcb_content, selected_hsh, selected_fungsi, callbacks.get('program_budaya')))
+    })
+
+@traced("analyze_impact")
+def analyze_impact(impact_content, selected_hsh, selected_fungsi, on_token=None):
     if impact_content is None:
         return "Analisis impact tidak dapat dilakukan karena tidak ada file impact to business yang diupload."
     
-    # Batasi ukuran content untuk Impact to Business (biasanya lebih besar)
-    limited_content = impact_content[:3000]  # Lebih ketat untuk impact
+    # Dokumen besar diringkas dulu (map-reduce) agar seluruh isi terwakili dalam batas prompt
+    if len(impact_content) > IMPACT_CHAR_BUDGET:
+        if on_token is not None:
+            on_token(f"⏳ Meringkas dokumen Impact ({len(impact_content):,} karakter) per bagian...")
+        limited_content = summarize_large_document(impact_content, selected_hsh, selected_fungsi)
+    else:
+        limited_content = impact_content
     
     prompt = f"""
 Analisis Impact to Business untuk fungsi {selected_fungsi} di HSH {selected_hsh}.
@@ -297,64 +1692,136 @@ Format output:
 - [Saran 2] - **Reasoning:** [Potensi peningkatan]
 """
     # Gunakan timeout lebih panjang dan max_tokens lebih kecil untuk Impact
-    return call_deepseek(prompt, max_tokens=1000, timeout=90, max_retries=4)
+    response = call_deepseek(prompt, max_tokens=1000, timeout=90, max_retries=4, on_token=on_token)
+    # Analisis dari ringkasan yang sebagian memakai kutipan asli tidak disimpan sebagai hasil bagian
+    return FallbackResponse(response) if isinstance(limited_content, FallbackResponse) else response
+
+# Dimensi evidence: nilai fungsi di kolom 3+i SKOR_TOTAL_ALL, nilai benchmark di kolom 1+i sheet Evidence
+EVIDENCE_DIMENSIONS = ['Strategi Budaya', 'Monitoring & Evaluasi', 'Sosialisasi & Partisipasi',
+                       'Pelaporan Bulanan', 'Apresiasi Pelanggan', 'Pemahaman Program',
+                       'Reward & Consequences', 'SK AoC', 'Impact to Business']
+EVIDENCE_FUNGSI_COLUMNS = {name: 3 + i for i, name in enumerate(EVIDENCE_DIMENSIONS)}
+EVIDENCE_BENCHMARK_COLUMNS = {name: 1 + i for i, name in enumerate(EVIDENCE_DIMENSIONS)}
+
+# Dimensi survei: nama kolom fungsi dan benchmark (dicocokkan tanpa membedakan huruf besar/kecil)
+SURVEI_FUNGSI_COLUMNS = {
+    'Total': ('Skor Survei',),
+    'Pekerja': ('SKOR PEKERJA',),
+    'Mitra': ('SKOR MITRA KERJA',)
+}
+SURVEI_BENCHMARK_COLUMNS = {
+    'Total': ('Skor Total', 'Skor Survei'),
+    'Pekerja': ('Skor Pekerja',),
+    'Mitra': ('Skor Mitra', 'SKOR MITRA KERJA')
+}
+
+def format_score(value):
+    return str(value) if pd.notna(value) else 'N/A'
+
+# Mengambil kolom berdasarkan posisi (int) atau daftar nama alternatif; kolom yang tidak ada berisi NaN
+def extract_column(df, spec):
+    if isinstance(spec, int):
+        if spec < len(df.columns):
+            return df.iloc[:, spec]
+    else:
+        lookup = {str(column).strip().lower(): column for column in df.columns}
+        for name in spec:
+            if name.strip().lower() in lookup:
+                return df[lookup[name.strip().lower()]]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+# Tabel perbandingan seluruh fungsi vs benchmark dalam satu pass vektor: satu baris per Fungsi
+# (baris pertama, sama seperti analisis per fungsi), dengan nilai, gap, persentil dalam HSH dan status.
+def build_comparison_frame(scores, benchmark, fungsi_columns, benchmark_columns):
+    base = scores.drop_duplicates('Fungsi')
+    if 'HSH' in base.columns:
+        hsh = base['HSH'].astype(object)
+    else:
+        hsh = pd.Series(np.nan, index=base.index, dtype=object)
+    if 'HSH_normalized' in base.columns:
+        hsh_normalized = base['HSH_normalized'].astype(object)
+    else:
+        hsh_normalized = hsh.map(normalize_hsh)
+    hsh_normalized = hsh_normalized.where(hsh_normalized.notna(), '')
+
+    # Benchmark cukup di-resolve sekali per HSH unik, lalu dipetakan ke semua fungsi
+    matcher = get_hsh_matcher(benchmark['HSH_normalized'])
+    matches = {value: matcher.match(value) or matcher.default_match() for value in hsh_normalized.unique()}
+    positions = hsh_normalized.map({value: m.position if m else -1 for value, m in matches.items()}).to_numpy()
+
+    # Posisi -1 (tidak ada benchmark sama sekali) menunjuk ke elemen NaN yang ditambahkan di akhir
+    def benchmark_values(spec):
+        return np.append(extract_column(benchmark, spec).to_numpy(dtype=object), np.nan)[positions]
+
+    frame = pd.DataFrame({
+        'Fungsi': base['Fungsi'].to_numpy(dtype=object),
+        'HSH': hsh.to_numpy(),
+        'HSH Benchmark': benchmark_values(0),
+        'Metode Benchmark': hsh_normalized.map({v: m.method if m else None for v, m in matches.items()}).to_numpy(),
+        'Dasar Pemilihan Benchmark': hsh_normalized.map({v: m.reason if m else None for v, m in matches.items()}).to_numpy(),
+        'Skor Kecocokan Benchmark': hsh_normalized.map({v: m.score if m else np.nan for v, m in matches.items()}).to_numpy()
+    })
+
+    below_count = pd.Series(0, index=frame.index)
+    for dimension, spec in fungsi_columns.items():
+        fungsi_raw = extract_column(base, spec).to_numpy(dtype=object)
+        benchmark_raw = benchmark_values(benchmark_columns[dimension])
+        fungsi_numeric = pd.to_numeric(pd.Series(fungsi_raw, index=frame.index), errors='coerce')
+        benchmark_numeric = pd.to_numeric(pd.Series(benchmark_raw, index=frame.index), errors='coerce')
+        gap = fungsi_numeric - benchmark_numeric
 
-def analyze_evidence_comparison(skor_total, skor_benchmark_evidence, selected_hsh, selected_fungsi):
+        frame[f"{dimension} - Fungsi"] = fungsi_raw
+        frame[f"{dimension} - Benchmark"] = benchmark_raw
+        frame[f"{dimension} - Gap"] = gap.round(4)
+        frame[f"{dimension} - Persentil HSH"] = fungsi_numeric.groupby(frame['HSH'], dropna=False).rank(pct=True)
+        frame[f"{dimension} - Status"] = np.select(
+            [gap > 1e-9, gap < -1e-9, gap.notna()],
+            ['Di atas benchmark', 'Di bawah benchmark', 'Setara benchmark'],
+            default='N/A'
+        )
+        below_count += (gap < -1e-9).astype(int)
+
+    frame['Jumlah Dimensi Di Bawah Benchmark'] = below_count
+    return frame.set_index(pd.Index(frame['Fungsi'], name=None))
+
+# Pasangan sheet (skor, benchmark) dan pemetaan kolom untuk setiap tabel perbandingan
+COMPARISON_SOURCES = {
+    'evidence': ('skor_total', 'skor_benchmark_evidence', EVIDENCE_FUNGSI_COLUMNS, EVIDENCE_BENCHMARK_COLUMNS),
+    'survei': ('skor_survei', 'skor_benchmark_survei', SURVEI_FUNGSI_COLUMNS, SURVEI_BENCHMARK_COLUMNS)
+}
+
+@st.cache_resource(show_spinner=False)
+def build_cached_comparison_frame(kind, scores, benchmark):
+    fungsi_columns, benchmark_columns = COMPARISON_SOURCES[kind][2:]
+    return build_comparison_frame(scores, benchmark, fungsi_columns, benchmark_columns)
+
+# Frame dari repositori data skor memakai tabel yang sudah dibangun saat load;
+# frame lain (mis. data sintetis benchmark) di-cache berdasarkan hash isinya
+def get_comparison_frame(kind, scores, benchmark):
+    try:
+        comparison = get_scoring_data().comparison_for(kind, scores, benchmark)
+    except Exception:
+        comparison = None
+    if comparison is None:
+        comparison = build_cached_comparison_frame(kind, scores, benchmark)
+    return comparison
+
+def get_evidence_comparison_frame(skor_total, skor_benchmark_evidence):
+    return get_comparison_frame('evidence', skor_total, skor_benchmark_evidence)
+
+def get_survei_comparison_frame(skor_survei, skor_benchmark_survei):
+    return get_comparison_frame('survei', skor_survei, skor_benchmark_survei)
+
+@traced("analyze_evidence_comparison")
+def analyze_evidence_comparison(skor_total, skor_benchmark_evidence, selected_hsh, selected_fungsi, on_token=None):
     try:
-        fungsi_data = skor_total[skor_total['Fungsi'] == selected_fungsi]
-        if fungsi_data.empty:
+        comparison = get_evidence_comparison_frame(skor_total, skor_benchmark_evidence)
+        if selected_fungsi not in comparison.index:
             return f"Data fungsi '{selected_fungsi}' tidak ditemukan dalam file SKOR_TOTAL_ALL."
+        row = comparison.loc[selected_fungsi]
         
-        fungsi_hsh = fungsi_data.iloc[0]['HSH'] if 'HSH' in fungsi_data.columns else selected_hsh
-        fungsi_hsh_normalized = normalize_hsh(fungsi_hsh)
-        
-        benchmark_data = skor_benchmark_evidence[
-            skor_benchmark_evidence['HSH_normalized'] == fungsi_hsh_normalized
-        ]
-        
-        if benchmark_data.empty:
-            # Cari dengan fuzzy matching
-            match_found = False
-            for idx, row in skor_benchmark_evidence.iterrows():
-                benchmark_hsh_norm = row['HSH_normalized']
-                if fungsi_hsh_normalized in benchmark_hsh_norm or benchmark_hsh_norm in fungsi_hsh_normalized:
-                    benchmark_data = skor_benchmark_evidence.iloc[[idx]]
-                    match_found = True
-                    break
-            
-            if not match_found:
-                # Gunakan benchmark default
-                benchmark_data = skor_benchmark_evidence[
-                    skor_benchmark_evidence['HSH_normalized'].str.contains('PERTAMINA GROUP', case=False, na=False)
-                ]
-                if benchmark_data.empty:
-                    benchmark_data = skor_benchmark_evidence.head(1)
-        
-        kolom_names = ['Strategi Budaya', 'Monitoring & Evaluasi', 'Sosialisasi & Partisipasi', 
-                       'Pelaporan Bulanan', 'Apresiasi Pelanggan', 'Pemahaman Program', 
-                       'Reward & Consequences', 'SK AoC', 'Impact to Business']
-        
-        # Ambil nilai dengan penanganan error yang baik
-        def safe_get_value(dataframe, row_idx, col_idx):
-            try:
-                if col_idx < len(dataframe.columns):
-                    value = dataframe.iloc[row_idx, col_idx]
-                    return str(value) if pd.notna(value) else 'N/A'
-                return 'N/A'
-            except:
-                return 'N/A'
-        
-        fungsi_values = {}
-        for i, name in enumerate(kolom_names):
-            col_idx = 3 + i
-            fungsi_values[name] = safe_get_value(fungsi_data, 0, col_idx)
-        
-        benchmark_values = {}
-        for i, name in enumerate(kolom_names):
-            col_idx = 1 + i
-            benchmark_values[name] = safe_get_value(benchmark_data, 0, col_idx)
-        
-        benchmark_hsh_display = benchmark_data.iloc[0, 0] if not benchmark_data.empty else "Benchmark tidak tersedia"
+        fungsi_hsh = row['HSH'] if pd.notna(row['HSH']) else selected_hsh
+        benchmark_hsh_display = row['HSH Benchmark'] if row['Metode Benchmark'] else "Benchmark tidak tersedia"
         
         comparison_text = f"""
 PERBANDINGAN EVIDENCE
@@ -362,11 +1829,12 @@ PERBANDINGAN EVIDENCE
 Fungsi: {selected_fungsi}
 HSH Fungsi: {fungsi_hsh}
 HSH Benchmark: {benchmark_hsh_display}
+Dasar Pemilihan Benchmark: {row['Dasar Pemilihan Benchmark'] or "-"}
 
 Data ringkas:
 """
-        for name in kolom_names[:5]:  # Hanya tampilkan 5 kolom pertama untuk mengurangi ukuran
-            comparison_text += f"- {name}: Fungsi={fungsi_values.get(name, 'N/A')}, Benchmark={benchmark_values.get(name, 'N/A')}\n"
+        for name in EVIDENCE_DIMENSIONS[:5]:  # Hanya tampilkan 5 kolom pertama untuk mengurangi ukuran
+            comparison_text += f"- {name}: Fungsi={format_score(row[f'{name} - Fungsi'])}, Benchmark={format_score(row[f'{name} - Benchmark'])}\n"
         
         prompt = f"""
 Analisis perbandingan Evidence untuk fungsi {selected_fungsi} di HSH {selected_hsh}.
@@ -387,61 +1855,21 @@ Format output:
 - [Area 1] - **Reasoning:** [Saran]
 - [Area 2] - **Reasoning:** [Saran]
 """
-        return call_deepseek(prompt, max_tokens=1000, timeout=45)
+        return call_deepseek(prompt, max_tokens=1000, timeout=45, on_token=on_token)
         
     except Exception as e:
         return f"Error dalam analisis evidence: {str(e)}"
 
-def analyze_survei_comparison(skor_survei, skor_benchmark_survei, selected_hsh, selected_fungsi):
+@traced("analyze_survei_comparison")
+def analyze_survei_comparison(skor_survei, skor_benchmark_survei, selected_hsh, selected_fungsi, on_token=None):
     try:
-        fungsi_data = skor_survei[skor_survei['Fungsi'] == selected_fungsi]
-        if fungsi_data.empty:
+        comparison = get_survei_comparison_frame(skor_survei, skor_benchmark_survei)
+        if selected_fungsi not in comparison.index:
             return f"Data survei untuk fungsi '{selected_fungsi}' tidak ditemukan."
+        row = comparison.loc[selected_fungsi]
         
-        fungsi_hsh = fungsi_data.iloc[0]['HSH'] if 'HSH' in fungsi_data.columns else selected_hsh
-        fungsi_hsh_normalized = normalize_hsh(fungsi_hsh)
-        
-        benchmark_data = skor_benchmark_survei[
-            skor_benchmark_survei['HSH_normalized'] == fungsi_hsh_normalized
-        ]
-        
-        if benchmark_data.empty:
-            # Cari dengan fuzzy matching
-            match_found = False
-            for idx, row in skor_benchmark_survei.iterrows():
-                benchmark_hsh_norm = row['HSH_normalized']
-                if fungsi_hsh_normalized in benchmark_hsh_norm or benchmark_hsh_norm in fungsi_hsh_normalized:
-                    benchmark_data = skor_benchmark_survei.iloc[[idx]]
-                    match_found = True
-                    break
-            
-            if not match_found:
-                # Gunakan benchmark default
-                benchmark_data = skor_benchmark_survei[
-                    skor_benchmark_survei['HSH_normalized'].str.contains('PERTAMINA GROUP', case=False, na=False)
-                ]
-                if benchmark_data.empty:
-                    benchmark_data = skor_benchmark_survei.head(1)
-        
-        # Ambil data dengan aman
-        def safe_get_value(dataframe, row_idx, col_name, default='N/A'):
-            try:
-                if col_name in dataframe.columns:
-                    value = dataframe.iloc[row_idx][col_name]
-                    return str(value) if pd.notna(value) else default
-                return default
-            except:
-                return default
-        
-        skor_survei_val = safe_get_value(fungsi_data, 0, 'Skor Survei')
-        skor_pekerja_val = safe_get_value(fungsi_data, 0, 'SKOR PEKERJA')
-        skor_mitra_val = safe_get_value(fungsi_data, 0, 'SKOR MITRA KERJA')
-        
-        benchmark_pekerja = safe_get_value(benchmark_data, 0, 'Skor Pekerja', 'N/A')
-        benchmark_mitra = safe_get_value(benchmark_data, 0, 'Skor Mitra', 'N/A')
-        benchmark_survei = safe_get_value(benchmark_data, 0, 'Skor Total', 'N/A')
-        
-        benchmark_hsh_display = benchmark_data.iloc[0, 0] if not benchmark_data.empty else "Benchmark tidak tersedia"
+        fungsi_hsh = row['HSH'] if pd.notna(row['HSH']) else selected_hsh
+        benchmark_hsh_display = row['HSH Benchmark'] if row['Metode Benchmark'] else "Benchmark tidak tersedia"
         
         comparison_text = f"""
 PERBANDINGAN SURVEI
@@ -449,10 +1877,11 @@ PERBANDINGAN SURVEI
 Fungsi: {selected_fungsi}
 HSH Fungsi: {fungsi_hsh}
 HSH Benchmark: {benchmark_hsh_display}
+Dasar Pemilihan Benchmark: {row['Dasar Pemilihan Benchmark'] or "-"}
 
 Ringkasan skor:
-• Fungsi - Total: {skor_survei_val}, Pekerja: {skor_pekerja_val}, Mitra: {skor_mitra_val}
-• Benchmark - Total: {benchmark_survei}, Pekerja: {benchmark_pekerja}, Mitra: {benchmark_mitra}
+• Fungsi - Total: {format_score(row['Total - Fungsi'])}, Pekerja: {format_score(row['Pekerja - Fungsi'])}, Mitra: {format_score(row['Mitra - Fungsi'])}
+• Benchmark - Total: {format_score(row['Total - Benchmark'])}, Pekerja: {format_score(row['Pekerja - Benchmark'])}, Mitra: {format_score(row['Mitra - Benchmark'])}
 """
         
         prompt = f"""
@@ -474,19 +1903,332 @@ Format output:
 - [Area 1] - **Reasoning:** [Saran]
 - [Area 2] - **Reasoning:** [Saran]
 """
-        return call_deepseek(prompt, max_tokens=1000, timeout=45)
+        return call_deepseek(prompt, max_tokens=1000, timeout=45, on_token=on_token)
         
     except Exception as e:
         error_msg = f"Error dalam analisis survei: {str(e)}"
-        st.error(error_msg)
+        notify('error', error_msg)
         return error_msg
 
-def create_word_document(fungsi_name, analyses):
+# Jawaban pengganti yang dibuat tanpa konteks dokumen lengkap (fallback Impact, ringkasan Impact yang
+# sebagian gagal); tetap ditampilkan, tetapi tidak disimpan sebagai hasil bagian
+class FallbackResponse(str):
+    pass
+
+# Analisis Impact dengan percobaan ulang memakai parameter yang lebih aman jika gagal
+def analyze_impact_with_fallback(impact_content, selected_hsh, selected_fungsi, on_token=None):
+    impact = analyze_impact(impact_content, selected_hsh, selected_fungsi, on_token=on_token)
+    if "Error" in impact or "error" in impact.lower():
+        notify('warning', f"⚠️ Analisis Impact mengalami masalah: {impact[:100]}...")
+        notify('info', "💡 Sedang mencoba dengan parameter yang lebih aman...")
+        impact = FallbackResponse(call_deepseek(
+            f"Analisis singkat Impact to Business untuk {selected_fungsi}. Fokus pada 2 poin utama.",
+            max_tokens=500, timeout=120, max_retries=5, on_token=on_token
+        ))
+    return impact
+
+# Judul setiap bagian analisis, urutannya sama dengan tab dan dokumen Word
+ANALYSIS_SECTIONS = {
+    'strategi_budaya': "Strategi Budaya",
+    'program_budaya': "Program Budaya",
+    'impact': "Impact to Business",
+    'evidence_comparison': "Perbandingan Evidence",
+    'survei_comparison': "Perbandingan Survei"
+}
+
+# Engine eksekusi paralel: tasks berupa {key: (fungsi, args)}, hasil dikembalikan per key
+def run_concurrently(tasks, max_workers=None, on_task_done=None):
+    """Menjalankan task secara bersamaan dengan batas worker; on_task_done(key, hasil, selesai, total) dipanggil di thread pemanggil"""
+    results = {}
+    if not tasks:
+        return results
+    max_workers = max(1, min(max_workers or ANALYSIS_MAX_WORKERS, len(tasks)))
+
+    # Teruskan konteks Streamlit agar st.warning/st.info di dalam worker tetap tampil
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+    def attach_script_ctx():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=attach_script_ctx,
+                            thread_name_prefix="rapport-analysis") as executor:
+        # Setiap task mendapat salinan contextvars agar span di worker terhubung ke span pemanggil
+        futures = {executor.submit(contextvars.copy_context().run, func, *args): key for key, (func, args) in tasks.items()}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = f"Error dalam analisis {key}: {str(e)}"
+            if on_task_done is not None:
+                on_task_done(key, results[key], completed, len(futures))
+    return results
+
+# Versi prompt per bagian; naikkan jika prompt atau format output berubah agar hasil lama tidak dipakai ulang
+PROMPT_VERSIONS = {
+    'strategi_budaya': '1',
+    'program_budaya': '1',
+    'impact': '1',
+    'evidence_comparison': '1',
+    'survei_comparison': '1'
+}
+
+# Input yang menentukan hasil setiap bagian; bagian hanya dihitung ulang jika salah satu inputnya berubah
+SECTION_INPUTS = {
+    'strategi_budaya': ('pcb', 'pcb_mode', 'hsh', 'fungsi'),
+    'program_budaya': ('pcb', 'pcb_mode', 'hsh', 'fungsi'),
+    'impact': ('impact', 'hsh', 'fungsi'),
+    'evidence_comparison': ('evidence_row', 'hsh', 'fungsi'),
+    'survei_comparison': ('survei_row', 'hsh', 'fungsi')
+}
+
+def comparison_row_hash(comparison, fungsi):
+    if fungsi not in comparison.index:
+        return "missing"
+    return get_content_hash(comparison.loc[[fungsi]].to_json(orient='split', date_format='iso'))
+
+# Sidik jari per bagian: hash dari versi prompt dan nilai setiap input yang dideklarasikan di SECTION_INPUTS
+def compute_section_fingerprints(pcb_content, impact_content, skor_total, skor_survei, skor_benchmark_evidence,
+                                 skor_benchmark_survei, selected_hsh, selected_fungsi, pcb_mode=None):
+    inputs = {
+        'pcb': get_content_hash(pcb_content),
+        'impact': get_content_hash(impact_content),
+        'pcb_mode': pcb_mode or PCB_ANALYSIS_MODE,
+        'hsh': str(selected_hsh),
+        'fungsi': str(selected_fungsi),
+        'evidence_row': comparison_row_hash(get_evidence_comparison_frame(skor_total, skor_benchmark_evidence), selected_fungsi),
+        'survei_row': comparison_row_hash(get_survei_comparison_frame(skor_survei, skor_benchmark_survei), selected_fungsi)
+    }
+    return {
+        key: get_content_hash(json.dumps(
+            [key, PROMPT_VERSIONS[key], [inputs[name] for name in SECTION_INPUTS[key]]], ensure_ascii=False
+        ))
+        for key in ANALYSIS_SECTIONS
+    }
+
+# Hasil bagian yang tersimpan: dari section_store sesi dulu, lalu dari cache disk bersama (kunci "section:")
+def lookup_section(fingerprint, section_store):
+    if section_store is not None and fingerprint in section_store:
+        section_store[fingerprint] = section_store.pop(fingerprint)  # Pindahkan ke akhir (paling baru dipakai)
+        return section_store[fingerprint]
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        return llm_cache.get(get_content_hash(f"section:{fingerprint}"), counter="section_")
+    return None
+
+# Hasil error dan jawaban fallback (tanpa konteks dokumen) tidak disimpan agar run berikutnya mencoba ulang
+def store_section(fingerprint, text, section_store):
+    if is_error_response(text) or isinstance(text, FallbackResponse):
+        return
+    if section_store is not None:
+        section_store[fingerprint] = text
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        llm_cache.set(get_content_hash(f"section:{fingerprint}"), text)
+
+# Menjalankan kelima analisis secara bersamaan untuk satu fungsi.
+# section_callbacks opsional: {key: on_token} untuk menampilkan hasil streaming per bagian
+# pcb_mode: 'separate' atau 'combined' (default dari pengaturan pcb_analysis_mode)
+# section_store (opsional): dict sidik jari -> teks hasil dari run sebelumnya; dibaca dan diperbarui.
+# Bagian yang inputnya tidak berubah dipakai ulang tanpa panggilan API.
+def run_report_analyses(pcb_content, impact_content, skor_total, skor_survei, skor_benchmark_evidence,
+                        skor_benchmark_survei, selected_hsh, selected_fungsi, max_workers=None, on_section_done=None,
+                        section_callbacks=None, pcb_mode=None, section_store=None):
+    callbacks = section_callbacks or {}
+    fingerprints = compute_section_fingerprints(
+        pcb_content, impact_content, skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei,
+        selected_hsh, selected_fungsi, pcb_mode
+    )
+    reused = {}
+    for key, fingerprint in fingerprints.items():
+        text = lookup_section(fingerprint, section_store)
+        if text is not None:
+            reused[key] = text
+    annotate_span(reused_sections=len(reused))
+
+    tasks = {
+        'strategi_budaya': (analyze_strategi_budaya, (pcb_content, selected_hsh, selected_fungsi)),
+        'program_budaya': (analyze_program_budaya, (pcb_content, selected_hsh, selected_fungsi)),
+        'impact': (analyze_impact_with_fallback, (impact_content, selected_hsh, selected_fungsi)),
+        'evidence_comparison': (analyze_evidence_comparison, (skor_total, skor_benchmark_evidence, selected_hsh, selected_fungsi)),
+        'survei_comparison': (analyze_survei_comparison, (skor_survei, skor_benchmark_survei, selected_hsh, selected_fungsi))
+    }
+    tasks = {key: (func, args + (callbacks.get(key),)) for key, (func, args) in tasks.items() if key not in reused}
+
+    pcb_keys = ('strategi_budaya', 'program_budaya')
+    pcb_pending = [key for key in pcb_keys if key not in reused]
+    if (pcb_mode or PCB_ANALYSIS_MODE) == 'combined' and pcb_pending:
+        for key in pcb_pending:
+            del tasks[key]
+        # Hanya bagian yang benar-benar dianalisis ulang yang di-stream; tab bagian yang dipakai ulang tidak ditimpa
+        pcb_callbacks = {key: callbacks.get(key) for key in pcb_pending}
+        tasks['pcb_combined'] = (analyze_pcb_sections, (pcb_content, selected_hsh, selected_fungsi, pcb_callbacks))
+
+    # Bagian yang dipakai ulang langsung dilaporkan selesai
+    sections_done = [0]
+    def report_section(section_key, section_result):
+        sections_done[0] += 1
+        if on_section_done is not None:
+            on_section_done(section_key, section_result, sections_done[0], len(ANALYSIS_SECTIONS))
+
+    for key, text in reused.items():
+        report_section(key, text)
+
+    # Hasil gabungan PCB dipecah kembali menjadi dua bagian, termasuk untuk laporan progress
+    def on_task_done(key, result, completed, total):
+        if key == 'pcb_combined':
+            section_results = [(k, result[k] if isinstance(result, dict) else result) for k in pcb_pending]
+        else:
+            section_results = [(key, result)]
+        for section_key, section_result in section_results:
+            report_section(section_key, section_result)
+
+    results = run_concurrently(tasks, max_workers=max_workers, on_task_done=on_task_done)
+    combined = results.pop('pcb_combined', None)
+    if combined is not None:
+        for key in pcb_pending:
+            results[key] = combined[key] if isinstance(combined, dict) else combined
+    for key, result in results.items():
+        store_section(fingerprints[key], result, section_store)
+    results.update(reused)
+    return {key: results[key] for key in ANALYSIS_SECTIONS}
+
+# Judul bagian dokumen Word dan kunci hasil analisisnya, sesuai urutan laporan
+DOCX_SECTIONS = [
+    ('Analisis Strategi Budaya', 'strategi_budaya'),
+    ('Analisis Program Budaya', 'program_budaya'),
+    ('Analisis Impact to Business', 'impact'),
+    ('Analisis Perbandingan Evidence dengan Benchmark', 'evidence_comparison'),
+    ('Analisis Perbandingan Survei dengan Benchmark', 'survei_comparison')
+]
+
+# Template dibaca/dibangun sekali per proses; setiap laporan dibuka dari salinan bytes ini
+@st.cache_resource(show_spinner=False)
+def get_docx_template():
+    if DOCX_TEMPLATE_PATH:
+        with open(DOCX_TEMPLATE_PATH, 'rb') as f:
+            return f.read()
     doc = Document()
-    style = doc.styles['Normal']
-    font = style.font
+    font = doc.styles['Normal'].font
     font.name = 'Calibri'
     font.size = Pt(11)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+# Markdown yang dihasilkan analisis: heading (#), bullet (-, *, •), daftar bernomor, tabel (|...|),
+# garis pemisah, serta **tebal**, *miring*, dan `kode` di dalam baris
+MD_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*$')
+MD_BULLET = re.compile(r'^(\s*)[-*•]\s+(.*)$')
+MD_NUMBERED = re.compile(r'^(\s*)\d+[.)]\s+(.*)$')
+MD_RULE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+MD_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+MD_INLINE = re.compile(r'\*\*(.+?)\*\*|__(.+?)__|\*(?!\s)(.+?)(?<!\s)\*|`(.+?)`')
+
+def add_markdown_runs(paragraph, text):
+    position = 0
+    for match in MD_INLINE.finditer(text):
+        if match.start() > position:
+            paragraph.add_run(text[position:match.start()])
+        bold, bold_alt, italic, code = match.groups()
+        if code is not None:
+            paragraph.add_run(code).font.name = 'Consolas'
+        elif italic is not None:
+            paragraph.add_run(italic).italic = True
+        else:
+            paragraph.add_run(bold or bold_alt).bold = True
+        position = match.end()
+    if position < len(text):
+        paragraph.add_run(text[position:])
+
+def split_table_row(line):
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+def add_markdown_table(doc, rows, styles):
+    header, body = rows[0], [row for row in rows[1:] if not MD_TABLE_SEPARATOR.match(row)]
+    cells = [split_table_row(header)] + [split_table_row(row) for row in body]
+    width = max(len(row) for row in cells)
+    table = doc.add_table(rows=len(cells), cols=width)
+    if 'Table Grid' in styles:
+        table.style = 'Table Grid'
+    for row_cells, values in zip(table.rows, cells):
+        for cell, value in zip(row_cells.cells, values):
+            add_markdown_runs(cell.paragraphs[0], value)
+    for cell in table.rows[0].cells:
+        for run in cell.paragraphs[0].runs:
+            run.bold = True
+
+# Setiap daftar bernomor mendapat instance numbering baru (mulai dari 1) agar penomoran tidak
+# bersambung antar bagian laporan; None jika style tidak memakai numbering
+def new_numbering_instance(doc, style_name):
+    num_pr = doc.styles[style_name].element.pPr.numPr if doc.styles[style_name].element.pPr is not None else None
+    if num_pr is None or num_pr.numId is None:
+        return None
+    numbering = doc.part.numbering_part.numbering_definitions._numbering
+    abstract_id = numbering.num_having_numId(num_pr.numId.val).abstractNumId.val
+    num = numbering.add_num(abstract_id)
+    num.add_lvlOverride(ilvl=0).add_startOverride(1)
+    return num.numId
+
+# Style daftar dipilih sesuai indentasi; template tanpa style daftar memakai Normal dengan penanda manual
+def add_list_item(doc, text, indent, base_style, marker, styles, num_id=None):
+    style = base_style if indent < 2 else f'{base_style} 2'
+    if style not in styles:
+        style = base_style
+    if style in styles:
+        paragraph = doc.add_paragraph(style=style)
+        if num_id is not None and style == base_style:
+            paragraph._p.get_or_add_pPr().get_or_add_numPr().get_or_add_numId().val = num_id
+    else:
+        paragraph = doc.add_paragraph()
+        paragraph.add_run(marker)
+    add_markdown_runs(paragraph, text)
+
+def add_markdown(doc, text, styles):
+    lines = str(text or '').splitlines()
+    index = 0
+    num_id = None  # Instance numbering daftar bernomor yang sedang berjalan
+    while index < len(lines):
+        line = lines[index]
+        stripped = line.strip()
+        index += 1
+        if not stripped:
+            continue
+        numbered = MD_NUMBERED.match(line)
+        # Penomoran berlanjut selama baris masih item bernomor atau sub-bullet menjorok di bawahnya
+        if numbered is None and not (line[:1].isspace() and MD_BULLET.match(line)):
+            num_id = None
+        if MD_RULE.match(stripped):
+            continue
+        if stripped.startswith('|') and index < len(lines) and MD_TABLE_SEPARATOR.match(lines[index]):
+            rows = [stripped]
+            while index < len(lines) and lines[index].strip().startswith('|'):
+                rows.append(lines[index].strip())
+                index += 1
+            add_markdown_table(doc, rows, styles)
+            continue
+        heading = MD_HEADING.match(stripped)
+        if heading:
+            # Heading 1 dipakai judul bagian, jadi heading markdown mulai dari level 2
+            doc.add_heading(heading.group(2).strip('*'), min(max(len(heading.group(1)), 2), 4))
+            continue
+        bullet = MD_BULLET.match(line)
+        if bullet:
+            add_list_item(doc, bullet.group(2), len(bullet.group(1).expandtabs(4)), 'List Bullet', '• ', styles)
+            continue
+        if numbered:
+            marker = stripped.split(None, 1)[0] + ' '
+            if num_id is None and 'List Number' in styles:
+                num_id = new_numbering_instance(doc, 'List Number')
+            add_list_item(doc, numbered.group(2), len(numbered.group(1).expandtabs(4)), 'List Number', marker, styles,
+                          num_id=num_id)
+            continue
+        add_markdown_runs(doc.add_paragraph(), stripped)
+
+@traced("create_word_document")
+def create_word_document(fungsi_name, analyses):
+    doc = Document(io.BytesIO(get_docx_template()))
+    styles = {style.name for style in doc.styles}
     
     title = doc.add_heading('Rapport Writer Assistance', 0)
     title.alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -510,25 +2252,10 @@ def create_word_document(fungsi_name, analyses):
     intro_run.italic = True
     doc.add_paragraph()
     
-    doc.add_heading('1. Analisis Strategi Budaya', 1)
-    doc.add_paragraph(analyses['strategi_budaya'])
-    doc.add_paragraph()
-    
-    doc.add_heading('2. Analisis Program Budaya', 1)
-    doc.add_paragraph(analyses['program_budaya'])
-    doc.add_paragraph()
-    
-    doc.add_heading('3. Analisis Impact to Business', 1)
-    doc.add_paragraph(analyses['impact'])
-    doc.add_paragraph()
-    
-    doc.add_heading('4. Analisis Perbandingan Evidence dengan Benchmark', 1)
-    doc.add_paragraph(analyses['evidence_comparison'])
-    doc.add_paragraph()
-    
-    doc.add_heading('5. Analisis Perbandingan Survei dengan Benchmark', 1)
-    doc.add_paragraph(analyses['survei_comparison'])
-    doc.add_paragraph()
+    for number, (heading, key) in enumerate(DOCX_SECTIONS, 1):
+        doc.add_heading(f'{number}. {heading}', 1)
+        add_markdown(doc, analyses[key], styles)
+        doc.add_paragraph()
     
     doc.add_paragraph()
     doc.add_paragraph('_' * 80)
@@ -552,6 +2279,744 @@ def create_word_document(fungsi_name, analyses):
     doc_io.seek(0)
     return doc_io
 
+# Membuat dokumen Word; jika gagal, coba lagi dengan konten default untuk Impact
+def create_word_document_safe(fungsi_name, analyses):
+    try:
+        return create_word_document(fungsi_name, analyses)
+    except Exception as e:
+        notify('error', f"Error membuat dokumen: {str(e)}")
+        notify('error', "Mencoba dengan konten default untuk Impact...")
+        # Fallback untuk Impact
+        if "Error" in analyses['impact']:
+            analyses['impact'] = "Analisis Impact to Business tidak dapat ditampilkan secara lengkap karena masalah koneksi. Silakan coba lagi nanti."
+        try:
+            return create_word_document(fungsi_name, analyses)
+        except Exception as e2:
+            notify('error', f"Masih gagal membuat dokumen: {str(e2)}")
+            return None
+
+def safe_filename(name):
+    return str(name).replace(' ', '_').replace('/', '_')
+
+def report_filename(fungsi, when=None):
+    return f"Rapp_{safe_filename(fungsi)}_{(when or datetime.now()).strftime('%m_%d')}.docx"
+
+# Arsip ZIP laporan yang ditulis bertahap: setiap .docx langsung disalin ke arsip lalu dilepas dari memori,
+# sehingga pemakaian memori setara satu dokumen. manifest.json dan index.csv ditulis saat arsip ditutup.
+class ReportArchive:
+    COPY_CHUNK = 1024 * 1024
+
+    # target: path file atau objek file (mis. BytesIO untuk ZIP laporan sesi)
+    def __init__(self, target):
+        self.zip = zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.entries = []
+        self._names = set()
+        self._lock = threading.Lock()  # Dokumen bisa ditambahkan langsung dari beberapa thread worker
+
+    def _arcname(self, entry):
+        base = f"{safe_filename(entry['hsh'])}/{os.path.basename(entry.get('output') or report_filename(entry['fungsi']))}"
+        name, suffix = base, 1
+        while name in self._names:
+            suffix += 1
+            name = base.replace('.docx', f'_{suffix}.docx')
+        self._names.add(name)
+        return name
+
+    # .docx sudah terkompresi, jadi disimpan tanpa kompresi ulang (ZIP_STORED)
+    def _copy(self, entry, source):
+        with self._lock:
+            arcname = self._arcname(entry)
+            info = zipfile.ZipInfo(arcname, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with self.zip.open(info, 'w') as dest:
+                shutil.copyfileobj(source, dest, self.COPY_CHUNK)
+            self.entries.append(dict(entry, file=arcname))
+
+    def add_document(self, entry, doc_io):
+        doc_io.seek(0)
+        self._copy(entry, doc_io)
+
+    def add_file(self, entry, path):
+        with open(path, 'rb') as f:
+            self._copy(entry, f)
+
+    # Fungsi yang dilewati/gagal tetap dicatat di manifest
+    def record(self, entry):
+        with self._lock:
+            self.entries.append(dict(entry, file=None))
+
+    def close(self):
+        statuses = Counter(entry.get('status') for entry in self.entries)
+        manifest = {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'total': len(self.entries),
+            'status': dict(statuses),
+            'reports': self.entries
+        }
+        self.zip.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2, default=str))
+        index = io.StringIO()
+        writer = csv.writer(index)
+        writer.writerow(['HSH', 'Fungsi', 'Status', 'File', 'Bagian Gagal', 'Keterangan'])
+        for entry in self.entries:
+            writer.writerow([entry['hsh'], entry['fungsi'], entry.get('status'), entry.get('file') or '',
+                             ';'.join(entry.get('failed_sections') or []), entry.get('reason') or ''])
+        self.zip.writestr('index.csv', index.getvalue().encode('utf-8-sig'))
+        self.zip.close()
+
+# ===================== MODE BATCH (tanpa UI) =====================
+# Struktur folder upload: <uploads>/<Fungsi dengan spasi dan '/' diganti '_'>/pcb*.<ext> dan impact*.<ext>
+BATCH_UPLOAD_EXTENSIONS = ('xlsx', 'xls', 'pdf', 'png', 'jpg', 'jpeg', 'tif', 'tiff')
+
+def find_fungsi_uploads(uploads_dir, fungsi):
+    folder = os.path.join(uploads_dir, safe_filename(fungsi))
+    uploads = {'pcb': None, 'impact': None}
+    if not os.path.isdir(folder):
+        return uploads
+    for name in sorted(os.listdir(folder)):
+        lowered = name.lower()
+        if lowered.split('.')[-1] not in BATCH_UPLOAD_EXTENSIONS:
+            continue
+        for kind in uploads:
+            if uploads[kind] is None and lowered.startswith(kind):
+                uploads[kind] = os.path.join(folder, name)
+    return uploads
+
+def read_file_from_path(path, max_chars=None):
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return read_uploaded_file(f, max_chars=max_chars)
+
+# Checkpoint JSONL: satu baris per fungsi yang sudah diproses, sehingga run yang terhenti bisa dilanjutkan.
+# Hanya status 'ok' yang dianggap selesai; 'partial'/'error' diproses ulang pada run berikutnya.
+class BatchCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Baris terakhir bisa terpotong jika proses mati saat menulis
+                    self._update(entry)
+
+    def is_done(self, hsh, fungsi):
+        entry = self.completed.get((hsh, fungsi))
+        return entry is not None and os.path.exists(entry.get('output', ''))
+
+    def record(self, entry):
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._update(entry)
+
+    def _update(self, entry):
+        key = (entry['hsh'], entry['fungsi'])
+        if entry.get('status') == 'ok':
+            self.completed[key] = entry
+        else:
+            self.completed.pop(key, None)
+
+# Membuat satu laporan dari folder upload; mengembalikan (entry, BytesIO .docx atau None)
+@traced("report")
+def build_report_for_fungsi(data, hsh, fungsi, uploads_dir, section_workers=None, pcb_mode=None, mode='batch'):
+    annotate_span(hsh=hsh, fungsi=fungsi, mode=mode)
+    skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei = data
+    started = time.time()
+    entry = {'hsh': hsh, 'fungsi': fungsi}
+
+    uploads = find_fungsi_uploads(uploads_dir, fungsi)
+    if uploads['pcb'] is None:
+        entry.update(status='skipped', reason='File PCB tidak ditemukan')
+        return entry, None
+
+    pcb_content = read_file_from_path(uploads['pcb'], max_chars=PCB_CHAR_BUDGET)
+    impact_content = read_file_from_path(uploads['impact'], max_chars=IMPACT_MAX_CHARS or None)
+    analyses = run_report_analyses(
+        pcb_content, impact_content, skor_total, skor_survei, skor_benchmark_evidence,
+        skor_benchmark_survei, hsh, fungsi, max_workers=section_workers, pcb_mode=pcb_mode
+    )
+    doc_io = create_word_document_safe(fungsi, analyses)
+    if doc_io is None:
+        entry.update(status='error', reason='Gagal membuat dokumen Word')
+        return entry, None
+
+    # Laporan dengan bagian gagal tetap ditulis, tetapi berstatus 'partial' agar diulang saat resume
+    failed_sections = [key for key, text in analyses.items() if is_error_response(text)]
+    entry.update(status='partial' if failed_sections else 'ok', failed_sections=failed_sections,
+                 seconds=round(time.time() - started, 2))
+    if failed_sections:
+        entry['reason'] = f"{len(failed_sections)} bagian gagal: {', '.join(failed_sections)}"
+    return entry, doc_io
+
+def generate_report_for_fungsi(data, hsh, fungsi, uploads_dir, output_dir, section_workers=None, pcb_mode=None):
+    entry, doc_io = build_report_for_fungsi(data, hsh, fungsi, uploads_dir, section_workers, pcb_mode)
+    if doc_io is None:
+        return entry
+
+    # Tulis ke file sementara lalu rename, agar file .docx tidak pernah setengah jadi
+    output_path = os.path.join(output_dir, report_filename(fungsi))
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(doc_io.getbuffer())
+    os.replace(tmp_path, output_path)
+    entry['output'] = output_path
+    return entry
+
+# Laporan langsung disalin ke arsip di thread worker; hanya entry yang dikembalikan
+# sehingga dokumen dilepas dari memori begitu tersimpan
+def export_report_to_archive(archive, data, hsh, fungsi, uploads_dir, pcb_mode=None):
+    entry, doc_io = build_report_for_fungsi(data, hsh, fungsi, uploads_dir, None, pcb_mode, 'export')
+    if doc_io is None:
+        archive.record(entry)
+        return entry
+    try:
+        archive.add_document(entry, doc_io)
+    finally:
+        doc_io.close()
+    return entry
+
+def run_batch(uploads_dir, output_dir, hsh_filter=None, workers=4, section_workers=None, checkpoint_path=None,
+              pcb_mode=None, zip_path=None):
+    data = load_excel_files()
+    skor_total = data[0]
+    if skor_total is None:
+        print("Gagal memuat data Excel dari folder 'documents'.", file=sys.stderr)
+        return 1
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Tabel perbandingan seluruh fungsi ikut disimpan untuk dashboard/rekap
+    get_evidence_comparison_frame(data[0], data[2]).to_csv(os.path.join(output_dir, "perbandingan_evidence.csv"), index=False)
+    get_survei_comparison_frame(data[1], data[3]).to_csv(os.path.join(output_dir, "perbandingan_survei.csv"), index=False)
+    checkpoint = BatchCheckpoint(checkpoint_path or os.path.join(output_dir, "checkpoint.jsonl"))
+
+    pairs = get_scoring_data().index.pairs
+    if hsh_filter:
+        pairs = [(hsh, fungsi) for hsh, fungsi in pairs if hsh in hsh_filter]
+    pending = [(hsh, fungsi) for hsh, fungsi in pairs if not checkpoint.is_done(hsh, fungsi)]
+    print(f"{len(pairs)} fungsi ditemukan, {len(pairs) - len(pending)} sudah selesai, {len(pending)} akan diproses.")
+
+    tasks = {
+        (hsh, fungsi): (generate_report_for_fungsi, (data, hsh, fungsi, uploads_dir, output_dir, section_workers, pcb_mode))
+        for hsh, fungsi in pending
+    }
+
+    # Arsip ZIP diisi selagi laporan selesai (laporan dari run sebelumnya ikut dimasukkan dari disk)
+    archive = None
+    if zip_path:
+        zip_tmp_path = zip_path + ".tmp"
+        archive = ReportArchive(zip_tmp_path)
+        for hsh, fungsi in pairs:
+            if checkpoint.is_done(hsh, fungsi):
+                done_entry = checkpoint.completed[(hsh, fungsi)]
+                archive.add_file(done_entry, done_entry['output'])
+
+    def on_report_done(key, entry, completed, total):
+        if isinstance(entry, str):  # Exception di worker dikembalikan run_concurrently sebagai teks error
+            entry = {'hsh': key[0], 'fungsi': key[1], 'status': 'error', 'reason': entry}
+        checkpoint.record(entry)
+        if archive is not None:
+            if entry.get('output'):
+                archive.add_file(entry, entry['output'])
+            else:
+                archive.record(entry)
+        print(f"[{completed}/{total}] {entry['status']:<7} {entry['hsh']} / {entry['fungsi']}"
+              + (f" ({entry['reason']})" if entry.get('reason') else ""))
+
+    try:
+        results = run_concurrently(tasks, max_workers=workers, on_task_done=on_report_done)
+    finally:
+        if archive is not None:
+            archive.close()
+    if archive is not None:
+        os.replace(zip_tmp_path, zip_path)
+        print(f"Arsip ZIP: {zip_path}")
+    failed = sum(1 for entry in results.values()
+                 if not isinstance(entry, dict) or entry.get('status') in ('error', 'partial'))
+    return 1 if failed else 0
+
+def run_batch_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="RapportLCV_3fcoklat.py batch",
+        description="Membuat laporan .docx untuk setiap Fungsi di SKOR_TOTAL_ALL tanpa UI Streamlit."
+    )
+    parser.add_argument("--uploads", required=True, help="Folder berisi subfolder per Fungsi dengan file pcb* dan impact*")
+    parser.add_argument("--output", required=True, help="Folder tujuan file .docx dan checkpoint")
+    parser.add_argument("--hsh", action="append", help="Hanya proses HSH ini (boleh diulang)")
+    parser.add_argument("--workers", type=int, default=4, help="Jumlah fungsi yang diproses bersamaan")
+    parser.add_argument("--section-workers", type=int, default=None, help="Jumlah bagian analisis paralel per fungsi")
+    parser.add_argument("--api-concurrency", type=int, default=None, help="Batas global request DeepSeek bersamaan")
+    parser.add_argument("--checkpoint", default=None, help="Path file checkpoint (default: <output>/checkpoint.jsonl)")
+    parser.add_argument("--pcb-mode", choices=["separate", "combined"], default=None,
+                        help="Analisis Strategi/Program Budaya terpisah atau dalam satu permintaan JSON")
+    parser.add_argument("--zip", default=None, help="Tulis juga seluruh laporan ke arsip ZIP ini (dengan manifest)")
+    args = parser.parse_args(argv)
+
+    if args.api_concurrency:
+        set_api_concurrency(args.api_concurrency)
+    return run_batch(args.uploads, args.output, hsh_filter=args.hsh, workers=args.workers,
+                     section_workers=args.section_workers, checkpoint_path=args.checkpoint, pcb_mode=args.pcb_mode,
+                     zip_path=args.zip)
+
+# ===================== JOB LAPORAN LATAR BELAKANG =====================
+# Berkas upload disalin sebagai bytes agar job tetap bisa membacanya setelah rerun atau sesi terputus
+def snapshot_upload(uploaded_file):
+    if uploaded_file is None:
+        return None
+    buffer = io.BytesIO(uploaded_file.getvalue())
+    buffer.name = uploaded_file.name
+    return buffer
+
+class ReportJob:
+    def __init__(self, hsh, fungsi, stream=False, section_store=None, result_key=None):
+        self.id = uuid.uuid4().hex
+        self.result_key = result_key
+        self.hsh = hsh
+        self.fungsi = fungsi
+        self.stream = stream
+        self.status = 'queued'
+        self.progress = 0
+        self.message = "⏳ Menunggu giliran di antrian..."
+        self.sections = {}  # Teks per bagian (parsial saat streaming, final setelah selesai)
+        self.completed = set()
+        self.section_store = section_store  # Salinan hasil bagian sesi; diperbarui job lalu disimpan kembali oleh UI
+        self.analyses = None
+        self.document = None  # Bytes .docx
+        self.error = None
+        self.notices = deque(maxlen=JOB_MAX_NOTICES)  # (level st, pesan) dari pipeline, dirender saat polling
+        self.created = time.time()
+        self.finished = None
+
+    def add_notice(self, level, message):
+        self.notices.append((level, message))
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'error')
+
+    def cleanup(self):
+        pass
+
+# Job ekspor ZIP semua Fungsi dalam satu HSH; arsip ditulis ke file sementara, bukan ke memori
+class ExportJob(ReportJob):
+    def __init__(self, hsh, fungsi_list):
+        super().__init__(hsh, f"{len(fungsi_list)} fungsi")
+        self.fungsi_list = list(fungsi_list)
+        self.archive_path = None
+        self.summary = {}
+
+    def cleanup(self):
+        if self.archive_path and os.path.exists(self.archive_path):
+            os.remove(self.archive_path)
+
+# Antrian job bersama untuk semua sesi: jumlah laporan yang diproses bersamaan dibatasi JOB_MAX_CONCURRENT,
+# ekspor ZIP berjalan di antrian terpisah (max_exports) sehingga ekspor panjang tidak menahan laporan tunggal.
+# Hasil disimpan di memori sampai kedaluwarsa (JOB_TTL_MINUTES setelah selesai)
+class JobManager:
+    def __init__(self, max_workers, ttl_seconds, max_exports=1):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rapport-job')
+        self._export_executor = ThreadPoolExecutor(max_workers=max_exports, thread_name_prefix='rapport-export')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, data, hsh, fungsi, pcb_file, impact_file, stream=False, pcb_mode=None, section_store=None,
+               result_key=None):
+        self._expire()
+        job = ReportJob(hsh, fungsi, stream=stream, section_store=section_store, result_key=result_key)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, data, pcb_file, impact_file, pcb_mode)
+        return job.id
+
+    def submit_export(self, data, hsh, fungsi_list, uploads_dir, pcb_mode=None):
+        self._expire()
+        job = ExportJob(hsh, fungsi_list)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._export_executor.submit(self._run_export, job, data, uploads_dir, pcb_mode)
+        return job.id
+
+    def get(self, job_id):
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]
+            for job_id in expired:
+                self._jobs.pop(job_id).cleanup()
+
+    def _run(self, job, data, pcb_file, impact_file, pcb_mode):
+        skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei = data
+        job.status = 'running'
+        notice_token = _notice_sink.set(job.add_notice)
+        try:
+            with span('report', hsh=job.hsh, fungsi=job.fungsi, mode='ui'):
+                job.message = "📄 Membaca dokumen..."
+                # Hanya bagian awal dokumen yang dipakai prompt, jadi ekstraksi berhenti di batas karakter
+                pcb_content = read_uploaded_file(pcb_file, max_chars=PCB_CHAR_BUDGET)
+                impact_content = read_uploaded_file(impact_file, max_chars=IMPACT_MAX_CHARS or None) if impact_file else None
+                job.progress = 10
+                job.message = f"🔍 Menganalisis {len(ANALYSIS_SECTIONS)} bagian secara paralel..."
+
+                def on_section_done(key, result, completed, total):
+                    job.sections[key] = result
+                    job.completed.add(key)
+                    job.progress = 10 + int(80 * completed / total)
+                    job.message = f"✅ Analisis {ANALYSIS_SECTIONS[key]} selesai ({completed}/{total})"
+
+                section_callbacks = None
+                if job.stream:
+                    section_callbacks = {
+                        key: (lambda text, key=key: job.sections.__setitem__(key, text))
+                        for key in ANALYSIS_SECTIONS
+                    }
+                job.analyses = run_report_analyses(
+                    pcb_content, impact_content, skor_total, skor_survei, skor_benchmark_evidence,
+                    skor_benchmark_survei, job.hsh, job.fungsi, on_section_done=on_section_done,
+                    section_callbacks=section_callbacks, pcb_mode=pcb_mode, section_store=job.section_store
+                )
+
+                job.progress = 95
+                job.message = "📝 Membuat dokumen Word..."
+                doc_io = create_word_document_safe(job.fungsi, job.analyses)
+                job.document = doc_io.getvalue() if doc_io is not None else None
+            job.progress = 100
+            job.message = "✅ Analisis selesai!"
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.message = f"❌ Analisis gagal: {str(e)}"
+            job.status = 'error'
+        finally:
+            _notice_sink.reset(notice_token)
+            job.finished = time.time()
+
+    # Laporan dibuat EXPORT_WORKERS sekaligus dan langsung disalin ke arsip begitu selesai
+    def _run_export(self, job, data, uploads_dir, pcb_mode):
+        job.status = 'running'
+        notice_token = _notice_sink.set(job.add_notice)
+        fd, archive_path = tempfile.mkstemp(prefix='rapport-export-', suffix='.zip')
+        os.close(fd)
+        job.archive_path = archive_path
+        try:
+            archive = ReportArchive(archive_path)
+            job.message = f"🔍 Membuat {len(job.fungsi_list)} laporan..."
+            tasks = {
+                fungsi: (export_report_to_archive, (archive, data, job.hsh, fungsi, uploads_dir, pcb_mode))
+                for fungsi in job.fungsi_list
+            }
+
+            def on_report_done(fungsi, result, completed, total):
+                if isinstance(result, str):
+                    archive.record({'hsh': job.hsh, 'fungsi': fungsi, 'status': 'error', 'reason': result})
+                job.progress = int(95 * completed / total)
+                job.message = f"✅ {completed}/{total} laporan selesai ({fungsi})"
+
+            try:
+                run_concurrently(tasks, max_workers=EXPORT_WORKERS, on_task_done=on_report_done)
+            finally:
+                archive.close()
+            job.summary = dict(Counter(entry.get('status') for entry in archive.entries))
+            job.progress = 100
+            job.message = "✅ Arsip ZIP siap!"
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.message = f"❌ Ekspor gagal: {str(e)}"
+            job.status = 'error'
+        finally:
+            _notice_sink.reset(notice_token)
+            job.finished = time.time()
+
+@st.cache_resource(show_spinner=False)
+def get_job_manager():
+    return JobManager(JOB_MAX_CONCURRENT, JOB_TTL_MINUTES * 60, EXPORT_MAX_CONCURRENT)
+
+# ===================== HASIL LAPORAN PER SESI =====================
+ReportResult = namedtuple('ReportResult', ['hsh', 'fungsi', 'analyses', 'document', 'finished', 'notices'],
+                          defaults=((),))
+
+def upload_digest(upload):
+    return hashlib.sha256(upload.getvalue()).hexdigest() if upload is not None else "none"
+
+# Kunci hasil: HSH, Fungsi, dan hash isi file upload serta mode PCB
+def report_result_key(hsh, fungsi, pcb_upload, impact_upload, pcb_mode=None):
+    return (hsh, fungsi, get_content_hash(
+        f"{upload_digest(pcb_upload)}:{upload_digest(impact_upload)}:{pcb_mode or PCB_ANALYSIS_MODE}"
+    ))
+
+# Penyimpanan LRU hasil laporan di session_state, dibatasi total ukuran teks analisis dan dokumen
+class ReportResultStore:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def results(self):
+        return list(self._items.values())
+
+    @staticmethod
+    def result_size(result):
+        return len(result.document or b'') + sum(len(text.encode('utf-8')) for text in result.analyses.values())
+
+    def get(self, key):
+        result = self._items.get(key)
+        if result is not None:
+            self._items.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        if key in self._items:
+            self.total_bytes -= self.result_size(self._items.pop(key))
+        self._items[key] = result
+        self.total_bytes += self.result_size(result)
+        # Hasil terbaru selalu disimpan walaupun sendirian melebihi batas
+        while self.total_bytes > self.max_bytes and len(self._items) > 1:
+            _, evicted = self._items.popitem(last=False)
+            self.total_bytes -= self.result_size(evicted)
+
+# ZIP dari laporan yang sudah tersimpan di sesi, tanpa memanggil API; dibuat di memori karena
+# ukurannya dibatasi RESULT_STORE_MAX_MB
+def build_session_archive(results):
+    buffer = io.BytesIO()
+    archive = ReportArchive(buffer)
+    for result in results:
+        failed_sections = [key for key, text in result.analyses.items() if is_error_response(text)]
+        entry = {'hsh': result.hsh, 'fungsi': result.fungsi, 'status': 'partial' if failed_sections else 'ok',
+                 'failed_sections': failed_sections,
+                 'output': report_filename(result.fungsi, datetime.fromtimestamp(result.finished))}
+        if result.document is None:
+            archive.record(dict(entry, status='error', reason='Gagal membuat dokumen Word'))
+        else:
+            archive.add_document(entry, io.BytesIO(result.document))
+    archive.close()
+    return buffer.getvalue()
+
+def get_session_result_store():
+    if 'report_results' not in st.session_state:
+        st.session_state['report_results'] = ReportResultStore(RESULT_STORE_MAX_MB * 1024 * 1024)
+    return st.session_state['report_results']
+
+# Header dan tab hasil analisis; mengembalikan placeholder per bagian untuk diisi (atau di-stream)
+def render_result_tabs():
+    st.markdown("---")
+    st.header("📊 Hasil Analisis")
+
+    # 🟤 TAB - NUANSA COKLAT
+    st.markdown("""
+    <style>
+    .stTabs [data-baseweb="tab-list"] {
+        background-color: #f5f0e6;
+        padding: 10px;
+        border-radius: 8px;
+    }
+    .stTabs [data-baseweb="tab"] {
+        height: 40px;
+        white-space: pre-wrap;
+        background-color: #e8dccf;
+        border-radius: 6px;
+        color: #4e342e;
+        font-weight: bold;
+        padding: 0 16px;
+        margin-right: 8px;
+    }
+    .stTabs [aria-selected="true"] {
+        background-color: #5d4037;
+        color: white;
+    }
+    </style>
+    """, unsafe_allow_html=True)
+
+    tabs = st.tabs(list(ANALYSIS_SECTIONS.values()))
+
+    placeholders = {}
+    for tab, (key, label) in zip(tabs, ANALYSIS_SECTIONS.items()):
+        with tab:
+            st.markdown(f"### Analisis {label}")
+            placeholders[key] = st.empty()
+    return placeholders
+
+# Pesan pipeline yang dikumpulkan job (percobaan ulang API, rate limit, info OCR, fallback)
+def render_notices(notices):
+    for level, message in notices:
+        getattr(st, level)(message)
+
+# Menampilkan status job; selama job berjalan, main() merender ulang halaman secara berkala
+def render_report_job(job):
+    st.success(f"✅ Memproses analisis untuk **{job.fungsi}** (HSH: {job.hsh})")
+    st.progress(job.progress)
+    st.text(job.message)
+    render_notices(list(job.notices))
+
+    if not job.is_finished:
+        # Mode streaming: tab hasil terisi selagi token diterima oleh job
+        if job.stream:
+            placeholders = render_result_tabs()
+            for key, placeholder in placeholders.items():
+                text = job.sections.get(key)
+                if not text:
+                    placeholder.info("⏳ Menunggu respons...")
+                else:
+                    placeholder.markdown(text if key in job.completed else text + " ▌")
+        return
+
+    if job.status == 'error':
+        st.error(f"❌ Analisis gagal: {job.error}")
+
+# Menampilkan hasil tersimpan (tab dan tombol download) tanpa memanggil API
+def render_report_result(result):
+    st.success(f"✅ Hasil analisis untuk **{result.fungsi}** (HSH: {result.hsh})")
+    if result.notices:
+        with st.expander(f"📋 Catatan Proses ({len(result.notices)})"):
+            render_notices(result.notices)
+    placeholders = render_result_tabs()
+    for key in ANALYSIS_SECTIONS:
+        placeholders[key].markdown(result.analyses[key])
+
+    st.markdown("---")
+    filename = report_filename(result.fungsi, datetime.fromtimestamp(result.finished))
+
+    # 🟤 TOMBOL DOWNLOAD - NUANSA COKLAT
+    st.markdown("""
+    <style>
+    .stDownloadButton > button {
+        background-color: #5d4037 !important;
+        color: white !important;
+        border: none !important;
+        padding: 12px 24px !important;
+        border-radius: 8px !important;
+        font-weight: bold !important;
+        font-size: 16px !important;
+        width: 100% !important;
+        transition: background-color 0.3s ease !important;
+    }
+    .stDownloadButton > button:hover {
+        background-color: #4e342e !important;
+    }
+    </style>
+    """, unsafe_allow_html=True)
+
+    if result.document is not None:
+        st.download_button(
+            label="📥 Download Hasil Analisis (.docx)",
+            data=result.document,
+            file_name=filename,
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            use_container_width=True
+        )
+
+        # 🟤 PESAN SUKSES - NUANSA COKLAT MUDA
+        st.markdown(f"""
+        <div style="
+            background-color: #f9f4ed;
+            padding: 12px;
+            border-radius: 8px;
+            border-left: 4px solid #5d4037;
+            margin-top: 10px;
+            color: #4e342e;
+            font-weight: bold;
+        ">
+            ✅ Dokumen siap didownload: <strong>{filename}</strong>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.error("❌ Gagal membuat dokumen akhir. Silakan screenshot hasil analisis di atas.")
+
+def read_file_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+# Data tombol download: dengan DEFERRED_DOWNLOAD, load(*args) baru dijalankan saat tombol diklik
+# sehingga arsip tidak dibaca/dibuat ulang dan ditahan di memori pada setiap rerun
+def download_data(load, *args):
+    return functools.partial(load, *args) if DEFERRED_DOWNLOAD else load(*args)
+
+def render_export_job(job):
+    st.markdown("---")
+    st.subheader(f"📦 Ekspor ZIP HSH {job.hsh}")
+    st.progress(job.progress)
+    st.text(job.message)
+    render_notices(list(job.notices))
+    if job.status == 'error':
+        st.error(f"❌ Ekspor gagal: {job.error}")
+    elif job.status == 'done':
+        st.caption(", ".join(f"{status}: {count}" for status, count in job.summary.items()))
+        st.download_button(
+            label="📥 Download Semua Laporan (.zip)",
+            data=download_data(read_file_bytes, job.archive_path),
+            file_name=f"Rapp_{safe_filename(job.hsh)}_{datetime.fromtimestamp(job.finished).strftime('%m_%d')}.zip",
+            mime="application/zip",
+            use_container_width=True
+        )
+
+# Ringkasan span: persentil durasi per tahap, total token, dan cache hit rate dari run terakhir
+def summarize_spans(spans):
+    durations = spans.groupby('name')['duration_ms']
+    summary = durations.quantile([0.5, 0.9, 0.99]).unstack()
+    summary.columns = ['p50 (ms)', 'p90 (ms)', 'p99 (ms)']
+    summary.insert(0, 'Jumlah', durations.size())
+    summary['Total (ms)'] = durations.sum()
+    summary['Error'] = spans[spans['status'] != 'ok'].groupby('name').size().reindex(summary.index, fill_value=0)
+    return summary.round(1).sort_values('Total (ms)', ascending=False)
+
+def render_diagnostics_panel():
+    st.markdown("---")
+    st.header("📈 Diagnostik Performa")
+    try:
+        scoring_data = get_scoring_data()
+    except Exception:
+        scoring_data = None
+    if scoring_data is not None:
+        st.subheader("Data Skor di Memori")
+        st.caption(f"Satu salinan per proses, dipakai bersama semua sesi: {scoring_data.total_bytes() / 1024:.1f} KB")
+        st.dataframe(scoring_data.memory_footprint(), use_container_width=True, hide_index=True)
+
+    recorder = get_perf_recorder()
+    if recorder is None:
+        st.info("Pencatatan performa tidak aktif (pengaturan perf_log).")
+        return
+    spans = recorder.load_recent(max_runs=PERF_PANEL_RUNS)
+    if spans.empty or 'name' not in spans:
+        st.info("Belum ada data performa. Jalankan analisis terlebih dahulu.")
+        return
+
+    reports = spans[spans['name'] == 'report']
+    calls = spans[spans['name'] == 'call_deepseek']
+    col1, col2, col3, col4 = st.columns(4)
+    with col1: st.metric("Run Tercatat", spans['run_id'].nunique())
+    with col2: st.metric("p50 Rapport (detik)", f"{reports['duration_ms'].median() / 1000:.1f}" if not reports.empty else "-")
+    with col3:
+        tokens = sum(calls[column].fillna(0).sum() for column in ('prompt_tokens', 'completion_tokens') if column in calls)
+        st.metric("Total Token", f"{int(tokens):,}")
+    with col4:
+        hit_rate = calls['cache_hit'].dropna().astype(bool).mean() if 'cache_hit' in calls else float('nan')
+        st.metric("Cache Hit Rate", f"{hit_rate:.0%}" if hit_rate == hit_rate else "-")
+
+    st.subheader("Durasi per Tahap")
+    st.dataframe(summarize_spans(spans), use_container_width=True)
+
+    if not reports.empty:
+        st.subheader("Run Terakhir")
+        recent = reports.sort_values('start', ascending=False)
+        recent = recent.assign(
+            Waktu=pd.to_datetime(recent['start'], unit='s'),
+            Detik=(recent['duration_ms'] / 1000).round(1)
+        )
+        columns = [c for c in ('Waktu', 'hsh', 'fungsi', 'mode', 'Detik', 'status') if c in recent]
+        st.dataframe(recent[columns], use_container_width=True, hide_index=True)
+
 # Main App
 def main():
     st.title("📊 Rapport Writer Assistance")
@@ -578,15 +3043,15 @@ def main():
     
     st.sidebar.header("⚙️ Pengaturan Analisis")
     
-    hsh_list = sorted(skor_total['HSH'].unique().tolist())
-    selected_hsh = st.sidebar.selectbox("Pilih HSH:", options=hsh_list)
-    filtered_fungsi = sorted(skor_total[skor_total['HSH'] == selected_hsh]['Fungsi'].unique().tolist())
+    scoring_index = get_scoring_data().index
+    selected_hsh = st.sidebar.selectbox("Pilih HSH:", options=scoring_index.hsh_list)
+    filtered_fungsi = scoring_index.fungsi_for(selected_hsh)
     selected_fungsi = st.sidebar.selectbox("Pilih Fungsi:", options=filtered_fungsi)
     
     st.sidebar.markdown("---")
     st.sidebar.subheader("📁 Upload Dokumen")
-    uploaded_pcb = st.sidebar.file_uploader("Upload PCB", type=['xlsx', 'xls', 'pdf', 'png', 'jpg', 'jpeg'])
-    uploaded_impact = st.sidebar.file_uploader("Upload Impact to Business", type=['xlsx', 'xls', 'pdf', 'png', 'jpg', 'jpeg'])
+    uploaded_pcb = st.sidebar.file_uploader("Upload PCB", type=['xlsx', 'xls', 'pdf', 'png', 'jpg', 'jpeg', 'tif', 'tiff'])
+    uploaded_impact = st.sidebar.file_uploader("Upload Impact to Business", type=['xlsx', 'xls', 'pdf', 'png', 'jpg', 'jpeg', 'tif', 'tiff'])
     st.sidebar.markdown("---")
     
     # 🟤 TOMBOL MULAI ANALISIS - NUANSA COKLAT
@@ -609,179 +3074,102 @@ def main():
     </style>
     """, unsafe_allow_html=True)
 
+    stream_output = st.sidebar.checkbox("⚡ Tampilkan hasil secara langsung (streaming)", value=STREAMING_DEFAULT)
     analyze_button = st.sidebar.button("🚀 Mulai Analisis", use_container_width=True)
+    show_diagnostics = st.sidebar.checkbox("📈 Panel Diagnostik Performa", value=False)
+
+    st.sidebar.markdown("---")
+    st.sidebar.subheader("📦 Ekspor ZIP")
+    # Diisi setelah hasil job terbaru masuk ke penyimpanan sesi
+    session_export_area = st.sidebar.container()
+    # Ekspor server hanya ditawarkan jika deployment menyediakan folder upload per Fungsi (seperti mode batch)
+    export_button = False
+    if os.path.isdir(UPLOADS_DIR):
+        st.sidebar.caption(f"Memakai file pcb* dan impact* di folder `{UPLOADS_DIR}/<Fungsi>` untuk setiap Fungsi di HSH terpilih.")
+        export_button = st.sidebar.button("📦 Ekspor ZIP HSH Terpilih", use_container_width=True)
+
+    cache_stats = get_llm_cache_stats()
+    if cache_stats is not None:
+        st.sidebar.caption(
+            f"💾 Cache LLM: {cache_stats['entries']} respons tersimpan, "
+            f"{cache_stats['hits']} hit / {cache_stats['misses']} miss"
+        )
     
+    job_manager = get_job_manager()
+    result_store = get_session_result_store()
     if analyze_button:
         if uploaded_pcb is None:
             st.error("⚠️ Silakan upload file PCB terlebih dahulu!")
             st.stop()
-        
-        st.success(f"✅ Memproses analisis untuk **{selected_fungsi}** (HSH: {selected_hsh})")
-        
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        pcb_content = read_uploaded_file(uploaded_pcb)
-        impact_content = read_uploaded_file(uploaded_impact) if uploaded_impact else None
-        
-        status_text.text("🔍 Menganalisis Strategi Budaya...")
-        progress_bar.progress(20)
-        strategi_budaya = analyze_strategi_budaya(pcb_content, selected_hsh, selected_fungsi)
-        
-        status_text.text("🔍 Menganalisis Program Budaya...")
-        progress_bar.progress(40)
-        program_budaya = analyze_program_budaya(pcb_content, selected_hsh, selected_fungsi)
-        
-        status_text.text("🔍 Menganalisis Impact to Business...")
-        progress_bar.progress(60)
-        impact = analyze_impact(impact_content, selected_hsh, selected_fungsi)
-        
-        # Tambahkan debugging untuk Impact analysis
-        if "Error" in impact or "error" in impact.lower():
-            st.warning(f"⚠️ Analisis Impact mengalami masalah: {impact[:100]}...")
-            st.info("💡 Sedang mencoba dengan parameter yang lebih aman...")
-            # Coba dengan parameter lebih aman
-            impact = call_deepseek(f"Analisis singkat Impact to Business untuk {selected_fungsi}. Fokus pada 2 poin utama.", 
-                                 max_tokens=500, timeout=120, max_retries=5)
-        
-        status_text.text("🔍 Menganalisis Perbandingan Evidence...")
-        progress_bar.progress(80)
-        evidence_comparison = analyze_evidence_comparison(skor_total, skor_benchmark_evidence, selected_hsh, selected_fungsi)
-        
-        status_text.text("🔍 Menganalisis Perbandingan Survei...")
-        progress_bar.progress(90)
-        survei_comparison = analyze_survei_comparison(skor_survei, skor_benchmark_survei, selected_hsh, selected_fungsi)
-        
-        status_text.text("📝 Membuat dokumen Word...")
-        progress_bar.progress(95)
-        
-        analyses = {
-            'strategi_budaya': strategi_budaya,
-            'program_budaya': program_budaya,
-            'impact': impact,
-            'evidence_comparison': evidence_comparison,
-            'survei_comparison': survei_comparison
-        }
-        
-        try:
-            doc_io = create_word_document(selected_fungsi, analyses)
-        except Exception as e:
-            st.error(f"Error membuat dokumen: {str(e)}")
-            st.error("Mencoba dengan konten default untuk Impact...")
-            # Fallback untuk Impact
-            if "Error" in analyses['impact']:
-                analyses['impact'] = "Analisis Impact to Business tidak dapat ditampilkan secara lengkap karena masalah koneksi. Silakan coba lagi nanti."
-            try:
-                doc_io = create_word_document(selected_fungsi, analyses)
-            except Exception as e2:
-                st.error(f"Masih gagal membuat dokumen: {str(e2)}")
-                doc_io = None
-        
-        progress_bar.progress(100)
-        status_text.text("✅ Analisis selesai!")
-        st.balloons()
-        
-        st.markdown("---")
-        st.header("📊 Hasil Analisis")
-        
-        # 🟤 TAB - NUANSA COKLAT
-        st.markdown("""
-        <style>
-        .stTabs [data-baseweb="tab-list"] {
-            background-color: #f5f0e6;
-            padding: 10px;
-            border-radius: 8px;
-        }
-        .stTabs [data-baseweb="tab"] {
-            height: 40px;
-            white-space: pre-wrap;
-            background-color: #e8dccf;
-            border-radius: 6px;
-            color: #4e342e;
-            font-weight: bold;
-            padding: 0 16px;
-            margin-right: 8px;
-        }
-        .stTabs [aria-selected="true"] {
-            background-color: #5d4037;
-            color: white;
-        }
-        </style>
-        """, unsafe_allow_html=True)
 
-        tab1, tab2, tab3, tab4, tab5 = st.tabs([
-            "Strategi Budaya", 
-            "Program Budaya", 
-            "Impact to Business",
-            "Perbandingan Evidence",
-            "Perbandingan Survei"
-        ])
-        
-        with tab1: 
-            st.markdown("### Analisis Strategi Budaya")
-            st.markdown(strategi_budaya)
-        with tab2: 
-            st.markdown("### Analisis Program Budaya")
-            st.markdown(program_budaya)
-        with tab3: 
-            st.markdown("### Analisis Impact to Business")
-            st.markdown(impact)
-        with tab4: 
-            st.markdown("### Analisis Perbandingan Evidence")
-            st.markdown(evidence_comparison)
-        with tab5: 
-            st.markdown("### Analisis Perbandingan Survei")
-            st.markdown(survei_comparison)
-        
-        st.markdown("---")
-        today = datetime.now().strftime('%m_%d')
-        filename = f"Rapp_{selected_fungsi.replace(' ', '_').replace('/', '_')}_{today}.docx"
+        pcb_upload = snapshot_upload(uploaded_pcb)
+        impact_upload = snapshot_upload(uploaded_impact)
+        result_key = report_result_key(selected_hsh, selected_fungsi, pcb_upload, impact_upload)
+        stored_result = result_store.get(result_key)
+        if stored_result is not None and not any(is_error_response(text) for text in stored_result.analyses.values()):
+            # Input sama persis dengan hasil lengkap yang sudah tersimpan: tampilkan ulang tanpa memanggil API.
+            # Hasil dengan bagian gagal dijalankan ulang; bagian yang berhasil dipakai ulang dari section_results.
+            st.session_state['current_result_key'] = result_key
+            st.session_state.pop('report_job_id', None)
+        else:
+            # Analisis berjalan sebagai job latar belakang; sesi hanya menyimpan ID job dan memantau statusnya.
+            # Hasil bagian dari run sebelumnya ikut dikirim agar bagian yang inputnya tidak berubah dipakai ulang.
+            st.session_state['report_job_id'] = job_manager.submit(
+                (skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei),
+                selected_hsh, selected_fungsi, pcb_upload, impact_upload, stream=stream_output,
+                section_store=dict(st.session_state.get('section_results', {})), result_key=result_key
+            )
 
-        # 🟤 TOMBOL DOWNLOAD - NUANSA COKLAT
-        st.markdown("""
-        <style>
-        .stDownloadButton > button {
-            background-color: #5d4037 !important;
-            color: white !important;
-            border: none !important;
-            padding: 12px 24px !important;
-            border-radius: 8px !important;
-            font-weight: bold !important;
-            font-size: 16px !important;
-            width: 100% !important;
-            transition: background-color 0.3s ease !important;
-        }
-        .stDownloadButton > button:hover {
-            background-color: #4e342e !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
+    job = None
+    if 'report_job_id' in st.session_state:
+        job = job_manager.get(st.session_state['report_job_id'])
+        if job is None:
+            del st.session_state['report_job_id']
+            st.warning("⌛ Hasil analisis sebelumnya sudah kedaluwarsa. Silakan jalankan analisis kembali.")
+        elif job.status == 'done':
+            # Job selesai: hasil dipindahkan ke penyimpanan sesi, tampilan berikutnya dirender dari sana
+            result = ReportResult(job.hsh, job.fungsi, job.analyses, job.document, job.finished, tuple(job.notices))
+            result_store.put(job.result_key, result)
+            st.session_state['current_result_key'] = job.result_key
+            if job.section_store is not None:
+                # Hanya SECTION_STORE_MAX_ENTRIES hasil bagian terbaru yang disimpan di sesi
+                entries = list(job.section_store.items())[-SECTION_STORE_MAX_ENTRIES:]
+                st.session_state['section_results'] = dict(entries)
+            del st.session_state['report_job_id']
+            job = None
+            st.balloons()
 
-        if doc_io is not None:
-            st.download_button(
-                label="📥 Download Hasil Analisis (.docx)",
-                data=doc_io,
-                file_name=filename,
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                use_container_width=True
-            )
+    current_result = None
+    if job is None and 'current_result_key' in st.session_state:
+        current_result = result_store.get(st.session_state['current_result_key'])
 
-            # 🟤 PESAN SUKSES - NUANSA COKLAT MUDA
-            st.markdown(f"""
-            <div style="
-                background-color: #f9f4ed;
-                padding: 12px;
-                border-radius: 8px;
-                border-left: 4px solid #5d4037;
-                margin-top: 10px;
-                color: #4e342e;
-                font-weight: bold;
-            ">
-                ✅ Dokumen siap didownload: <strong>{filename}</strong>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.error("❌ Gagal membuat dokumen akhir. Silakan screenshot hasil analisis di atas.")
-    
+    session_results = result_store.results()
+    if session_results:
+        session_export_area.download_button(
+            label=f"📥 Download {len(session_results)} Laporan Sesi Ini (.zip)",
+            data=download_data(build_session_archive, session_results),
+            file_name=f"Rapp_sesi_{datetime.now().strftime('%m_%d')}.zip",
+            mime="application/zip",
+            use_container_width=True
+        )
+    else:
+        session_export_area.caption("Laporan yang sudah dianalisis di sesi ini dapat diunduh sekaligus sebagai ZIP.")
+
+    if export_button:
+        st.session_state['export_job_id'] = job_manager.submit_export(
+            (skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei),
+            selected_hsh, filtered_fungsi, UPLOADS_DIR
+        )
+    export_job = None
+    if 'export_job_id' in st.session_state:
+        export_job = job_manager.get(st.session_state['export_job_id'])
+        if export_job is None:
+            del st.session_state['export_job_id']
+
+    if job is not None:
+        render_report_job(job)
+    elif current_result is not None:
+        render_report_result(current_result)
     else:
         st.info("👈 Silakan pilih HSH, Fungsi, upload file, dan klik tombol **Mulai Analisis** di sidebar")
         col1, col2 = st.columns(2)
@@ -797,5 +3185,19 @@ def main():
         - API key disimpan aman melalui **Streamlit Secrets**
         """)
 
+    if export_job is not None:
+        render_export_job(export_job)
+
+    if show_diagnostics:
+        render_diagnostics_panel()
+
+    # Selama masih ada job berjalan, halaman dirender ulang berkala tanpa menunggu jaringan
+    if any(pending is not None and not pending.is_finished for pending in (job, export_job)):
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+
 if __name__ == "__main__":
+    # python RapportLCV_3fcoklat.py batch --uploads <folder> --output <folder>
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(run_batch_cli(sys.argv[2:]))
     main()
@@ -0,0 +1,443 @@
+"""Benchmark Rapport Writer Assistance dengan data sintetis dan server DeepSeek palsu.
+
+Contoh:
+    python benchmarks/bench_rapport.py --rows 1000 10000 100000 --output hasil.json
+    python benchmarks/bench_rapport.py --rows 1000 --compare hasil.json --fail-on-regression
+
+Semua data (workbook SKOR_TOTAL/Skor_SURVEI/Skor_benchmark, PDF, gambar, upload Excel)
+dibuat di direktori sementara, dan panggilan API diarahkan ke server lokal sehingga hasil
+bisa dibandingkan antar commit tanpa bergantung pada jaringan.
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EVIDENCE_HEADERS = [
+    'Strategi Budaya', 'Monitoring & Evaluasi program budaya oleh AoC dan Pimpinan',
+    'Sosialisasi & partisipasi dalam program budaya', 'Pelaporan bulanan', 'Apresiasi dari pelanggan',
+    'Pemahaman program budaya', 'Reward & concequences untuk pekerja dan mitra kerja',
+    'SK AoC dan sistem implementasi AKHLAK', 'Impact to Business dari Program Budaya'
+]
+SURVEI_HEADERS = [
+    'P. AKHLAK', 'P. ONE Pertamina', 'P. Program Budaya', 'P. Keberlanjutan', 'P. Safety', 'SKOR PEKERJA',
+    'MK. AKHLAK', 'MK. ONE Pertamina', 'MK. Program Budaya', 'MK. Keberlanjutan', 'MK. Safety',
+    'SKOR MITRA KERJA', 'Skor Survei'
+]
+HSH_NAMES = ['Pertamina Group', 'SH GAS', 'SH Upstream', 'SH Refining & Petrochemical', 'SH C&T',
+             'SH Integrated Marine Logistics', 'SH Power & NRE', 'AP, Portfolio & Services, Yayasan',
+             'Holding', 'Sub Holding Commercial & Trading']
+LOREM = ("Program budaya AKHLAK dijalankan melalui sosialisasi rutin, monitoring bulanan oleh AoC, "
+         "apresiasi pelanggan dan pelaporan dampak terhadap bisnis. ")
+
+
+# ===================== DATA SINTETIS =====================
+
+def fungsi_names(rows):
+    return [f"Fungsi {i:06d} - {HSH_NAMES[1 + i % (len(HSH_NAMES) - 1)]}" for i in range(rows)]
+
+def write_workbooks(documents_dir, rows, seed):
+    rng = np.random.default_rng(seed)
+    os.makedirs(documents_dir, exist_ok=True)
+    names = fungsi_names(rows)
+    hsh = [name.split(' - ', 1)[1] for name in names]
+
+    evidence = rng.integers(0, 71, size=(rows, len(EVIDENCE_HEADERS)))
+    skor_total = pd.DataFrame(evidence, columns=EVIDENCE_HEADERS)
+    skor_total.insert(0, 'HSH', hsh)
+    skor_total.insert(0, 'Fungsi', names)
+    skor_total.insert(0, 'No', np.arange(1, rows + 1))
+    skor_total['Skor Evidence'] = evidence.sum(axis=1)
+    skor_total['Skor Survei'] = rng.uniform(60, 150, rows).round(2)
+    skor_total['Skor Final'] = skor_total['Skor Evidence'] + skor_total['Skor Survei']
+    skor_total.to_excel(os.path.join(documents_dir, 'SKOR_TOTAL_ALL.xlsx'), sheet_name='SKOR TOTAL_ALL', index=False)
+
+    survei = pd.DataFrame(rng.uniform(0, 70, size=(rows, len(SURVEI_HEADERS))).round(6), columns=SURVEI_HEADERS)
+    survei.insert(0, 'Posisi', 'VP/ Setara VP')
+    survei.insert(0, 'Fungsi', names)
+    survei.insert(0, 'Direktorat', 'Direktorat Sintetis')
+    survei.insert(0, 'Perusahaan', 'PT Sintetis')
+    survei.insert(0, 'Area/Regional', 'No Area')
+    survei.insert(0, 'HSH', hsh)
+    survei.insert(0, 'No', np.arange(1, rows + 1))
+    survei.to_excel(os.path.join(documents_dir, 'Skor_SURVEI_ALL.xlsx'), sheet_name='Skor_SURVEI_ALL_FUNGSI', index=False)
+
+    benchmark_evidence = pd.DataFrame(rng.uniform(10, 70, size=(len(HSH_NAMES), len(EVIDENCE_HEADERS))),
+                                      columns=EVIDENCE_HEADERS)
+    benchmark_evidence.insert(0, 'HSH', HSH_NAMES)
+    benchmark_evidence['SKOR Total Rata-rata'] = benchmark_evidence[EVIDENCE_HEADERS].sum(axis=1)
+    benchmark_survei = pd.DataFrame(rng.uniform(3, 70, size=(len(HSH_NAMES), len(SURVEI_HEADERS))),
+                                    columns=SURVEI_HEADERS)
+    benchmark_survei.insert(0, 'HSH', HSH_NAMES)
+    with pd.ExcelWriter(os.path.join(documents_dir, 'Skor_benchmark.xlsx')) as writer:
+        benchmark_evidence.to_excel(writer, sheet_name='Evidence', index=False)
+        # Sheet Survei asli diawali satu baris kosong sebelum header
+        benchmark_survei.to_excel(writer, sheet_name='Survei', index=False, startrow=1)
+    return names
+
+# PDF teks minimal (Helvetica, satu stream per halaman) tanpa dependensi tambahan
+def make_pdf(pages, lines_per_page=40):
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for page in range(pages):
+        lines = [f"Halaman {page + 1} baris {line + 1}: {LOREM[:80]}" for line in range(lines_per_page)]
+        content = "BT /F1 9 Tf 40 810 Td 12 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * page} 0 R >>".encode())
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream".encode())
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+def make_image(width, height, seed):
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(40, height - 40, 36):
+        words = LOREM.split()
+        rng.shuffle(words)
+        draw.text((40, y), " ".join(words[:12]), fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', dpi=(300, 300))
+    return buffer.getvalue()
+
+def make_upload_workbook(rows, seed):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'Program': [f"Program budaya {i}" for i in range(rows)],
+        'Kegiatan': [LOREM[:60]] * rows,
+        'Target': rng.integers(1, 100, rows),
+        'Realisasi': rng.uniform(0, 120, rows).round(2),
+        'Dampak (Rp juta)': rng.uniform(0, 5000, rows).round(1)
+    })
+    buffer = io.BytesIO()
+    frame.to_excel(buffer, sheet_name='Impact', index=False)
+    return buffer.getvalue()
+
+
+# ===================== SERVER DEEPSEEK PALSU =====================
+
+class FakeDeepSeek:
+    """Server chat/completions lokal dengan latensi, error 5xx, dan 429 yang bisa diatur."""
+
+    def __init__(self, latency=0.05, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _outcome(self):
+        with self.lock:
+            self.counts['requests'] += 1
+            roll = self.rng.random()
+            if roll < self.rate_limit_rate:
+                self.counts['rate_limited'] += 1
+                return 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.counts['errors'] += 1
+                return 500
+            return 200
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                time.sleep(fake.latency)
+                status = fake._outcome()
+                if status == 429:
+                    self._send(429, b'{"error": "rate limited"}', headers={'Retry-After': str(fake.retry_after)})
+                    return
+                if status != 200:
+                    self._send(status, b'{"error": "internal"}')
+                    return
+
+                prompt = payload['messages'][-1]['content']
+                if payload.get('response_format', {}).get('type') == 'json_object':
+                    content = json.dumps({'strategi_budaya': LOREM * 3, 'program_budaya': LOREM * 3})
+                else:
+                    content = LOREM * max(1, min(payload.get('max_tokens', 1000) // 40, 20))
+                usage = {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4}
+                if payload.get('stream'):
+                    chunks = [content[i:i + 40] for i in range(0, len(content), 40)]
+                    lines = [json.dumps({'choices': [{'delta': {'content': chunk}}]}) for chunk in chunks]
+                    lines.append(json.dumps({'choices': [], 'usage': usage}))
+                    body = "".join(f"data: {line}\n\n" for line in lines) + "data: [DONE]\n\n"
+                    self._send(200, body.encode('utf-8'), content_type='text/event-stream')
+                else:
+                    body = {'choices': [{'message': {'role': 'assistant', 'content': content}}], 'usage': usage}
+                    self._send(200, json.dumps(body).encode('utf-8'))
+
+        return Handler
+
+
+# ===================== PENGUKURAN =====================
+
+def measure(results, name, func, repeat, setup=None, **meta):
+    timings = []
+    value = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - started)
+    results[name] = dict(meta, repeat=repeat, min=min(timings), median=statistics.median(timings),
+                         max=max(timings))
+    print(f"  {name:<45} median {results[name]['median'] * 1000:10.1f} ms  (min {min(timings) * 1000:.1f} ms)")
+    return value
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_dataset(app, results, rows, args, workdir):
+    print(f"\n== {rows} baris ==")
+    names = write_workbooks(os.path.join(workdir, 'documents'), rows, args.seed)
+    snapshot_dir = os.path.join(workdir, app.SNAPSHOT_DIR)
+
+    def cold():
+        app.get_scoring_data.clear()
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    measure(results, f"load_excel_files.cold@{rows}", app.load_excel_files, args.repeat, setup=cold, rows=rows)
+    data = measure(results, f"load_excel_files.snapshot@{rows}", app.load_excel_files, args.repeat,
+                   setup=app.get_scoring_data.clear, rows=rows)
+    print(f"  data skor di memori: {app.get_scoring_data().total_bytes() / 1024:.1f} KB")
+    skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei = data
+
+    targets = skor_total['HSH_normalized'].tolist()
+    def match_all():
+        matcher = app.HSHMatcher(skor_benchmark_evidence['HSH_normalized'])
+        return [matcher.match(target) or matcher.default_match() for target in targets]
+    measure(results, f"hsh_matching@{rows}", match_all, args.repeat, rows=rows)
+
+    measure(results, f"comparison.evidence@{rows}",
+            lambda: app.build_comparison_frame(skor_total, skor_benchmark_evidence,
+                                               app.EVIDENCE_FUNGSI_COLUMNS, app.EVIDENCE_BENCHMARK_COLUMNS),
+            args.repeat, rows=rows)
+    measure(results, f"comparison.survei@{rows}",
+            lambda: app.build_comparison_frame(skor_survei, skor_benchmark_survei,
+                                               app.SURVEI_FUNGSI_COLUMNS, app.SURVEI_BENCHMARK_COLUMNS),
+            args.repeat, rows=rows)
+    return data, names
+
+def bench_files(app, results, args, workdir):
+    print("\n== Ekstraksi file ==")
+    files_dir = os.path.join(workdir, 'files')
+    os.makedirs(files_dir, exist_ok=True)
+    pdf_path = os.path.join(files_dir, 'dokumen.pdf')
+    with open(pdf_path, 'wb') as f:
+        f.write(make_pdf(args.pdf_pages))
+    xlsx_path = os.path.join(files_dir, 'impact.xlsx')
+    with open(xlsx_path, 'wb') as f:
+        f.write(make_upload_workbook(args.upload_rows, args.seed))
+
+    # Cache upload dikosongkan sebelum setiap pengulangan agar yang diukur adalah ekstraksi, bukan lookup cache
+    clear_upload_cache = app.get_upload_cache.clear
+    measure(results, "extract.pdf.budget", lambda: app.read_file_from_path(pdf_path, app.PCB_CHAR_BUDGET),
+            args.repeat, setup=clear_upload_cache, pages=args.pdf_pages)
+    measure(results, "extract.pdf.full", lambda: app.read_file_from_path(pdf_path, app.IMPACT_MAX_CHARS),
+            args.repeat, setup=clear_upload_cache, pages=args.pdf_pages)
+    measure(results, "extract.xlsx", lambda: app.read_file_from_path(xlsx_path, app.IMPACT_MAX_CHARS),
+            args.repeat, setup=clear_upload_cache, rows=args.upload_rows)
+    measure(results, "extract.pdf.full.cached", lambda: app.read_file_from_path(pdf_path, app.IMPACT_MAX_CHARS),
+            args.repeat, pages=args.pdf_pages)
+
+    if args.skip_ocr or shutil.which('tesseract') is None:
+        print("  extract.image dilewati (tesseract tidak tersedia atau --skip-ocr)")
+        return
+    width, height = args.image_size
+    image_bytes = make_image(width, height, args.seed)
+    measure(results, "extract.image.cold", lambda: app.ocr_image_bytes(image_bytes), args.repeat,
+            setup=app.get_ocr_cache.clear, size=[width, height])
+    measure(results, "extract.image.cached", lambda: app.ocr_image_bytes(image_bytes), args.repeat,
+            size=[width, height])
+
+def bench_reports(app, results, data, names, args, workdir, server):
+    print("\n== Dokumen dan laporan end-to-end ==")
+    analyses = {key: f"### {label}\n\n" + LOREM * 30 for key, label in app.ANALYSIS_SECTIONS.items()}
+    measure(results, "create_word_document", lambda: app.create_word_document(names[0], analyses), args.repeat)
+
+    uploads_dir = os.path.join(workdir, 'uploads')
+    output_dir = os.path.join(workdir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+    skor_total = data[0]
+    selected = skor_total[['HSH', 'Fungsi']].drop_duplicates().head(args.reports)
+    pdf_bytes = make_pdf(max(1, args.pdf_pages // 5))
+    xlsx_bytes = make_upload_workbook(args.upload_rows, args.seed)
+    for fungsi in selected['Fungsi']:
+        folder = os.path.join(uploads_dir, app.safe_filename(fungsi))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'pcb.pdf'), 'wb') as f:
+            f.write(pdf_bytes)
+        with open(os.path.join(folder, 'impact.xlsx'), 'wb') as f:
+            f.write(xlsx_bytes)
+
+    def run_reports():
+        entries = [app.generate_report_for_fungsi(data, hsh, fungsi, uploads_dir, output_dir)
+                   for hsh, fungsi in selected.itertuples(index=False)]
+        failed = [entry for entry in entries if entry.get('status') != 'ok' or entry.get('failed_sections')]
+        if failed:
+            print(f"  peringatan: {len(failed)} laporan gagal/sebagian gagal")
+        return entries
+
+    before = dict(server.counts)
+    measure(results, "report.end_to_end", run_reports, args.repeat, reports=len(selected),
+            latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    results["report.end_to_end"]['api_requests'] = {key: server.counts[key] - before[key] for key in before}
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n== Perbandingan dengan {baseline_path} (commit {baseline['meta'].get('commit')}) ==")
+    regressions = []
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            print(f"  {name:<45} (baru)")
+            continue
+        ratio = current['median'] / previous['median'] if previous['median'] else float('inf')
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESI"
+            regressions.append(name)
+        print(f"  {name:<45} {previous['median'] * 1000:10.1f} -> {current['median'] * 1000:10.1f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Rapport Writer Assistance dengan data sintetis")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help="Jumlah baris workbook sintetis")
+    parser.add_argument('--repeat', type=int, default=3, help="Pengulangan per pengukuran (median dilaporkan)")
+    parser.add_argument('--pdf-pages', type=int, default=100)
+    parser.add_argument('--upload-rows', type=int, default=2000, help="Jumlah baris upload Excel Impact")
+    parser.add_argument('--image-size', type=int, nargs=2, default=[2480, 3508], metavar=('LEBAR', 'TINGGI'))
+    parser.add_argument('--skip-ocr', action='store_true')
+    parser.add_argument('--reports', type=int, default=3, help="Jumlah laporan end-to-end per pengulangan")
+    parser.add_argument('--latency', type=float, default=0.2, help="Latensi server palsu (detik)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Proporsi respons 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Proporsi respons 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Nilai header Retry-After untuk 429")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Simpan hasil sebagai JSON")
+    parser.add_argument('--compare', help="File JSON hasil sebelumnya sebagai pembanding")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Batas regresi relatif (0.10 = 10%%)")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--keep-workdir', action='store_true')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    original_cwd = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix='rapport-bench-')
+    server = FakeDeepSeek(args.latency, args.error_rate, args.rate_limit_rate, args.retry_after, args.seed)
+    with server:
+        # Konfigurasi dibaca saat modul diimpor, jadi environment disiapkan sebelum import
+        os.environ.setdefault('DEEPSEEK_API_KEY', 'benchmark')
+        os.environ['RAPPORT_DEEPSEEK_BASE_URL'] = server.base_url
+        os.environ['RAPPORT_LLM_CACHE'] = '0'
+        os.environ['RAPPORT_PERF_LOG'] = '0'
+        os.environ['RAPPORT_STREAMING'] = '0'
+        os.environ['RAPPORT_UPLOAD_CACHE_PERSIST'] = '0'
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_DIR)
+        import RapportLCV_3fcoklat as app
+
+        results = {}
+        data = names = None
+        for rows in args.rows:
+            data, names = bench_dataset(app, results, rows, args, workdir)
+        bench_files(app, results, args, workdir)
+        bench_reports(app, results, data, names, args, workdir, server)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args)
+        },
+        'results': results
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nHasil disimpan ke {output}")
+
+    regressions = []
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+    if not args.keep_workdir:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        print(f"Direktori kerja: {workdir}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""HTTP API Rapport Writer Assistance tanpa UI Streamlit.
+
+Menjalankan pipeline yang sama dengan aplikasi (data skor, analyze_*, klien DeepSeek, cache LLM,
+pembuatan .docx) sebagai layanan WSGI. Jalankan dari direktori repo (folder 'documents' dibaca relatif):
+
+    python rapport_api.py --port 8080 --workers 4
+    gunicorn -w 4 --threads 8 -b 0.0.0.0:8080 rapport_api:application
+
+Endpoint:
+    GET  /health                      status layanan (503 jika data skor gagal dimuat)
+    GET  /metrics                     metrik proses worker yang menjawab (JSON)
+    GET  /api/options                 daftar HSH beserta Fungsi-nya
+    POST /api/reports                 multipart: hsh, fungsi, pcb (file), impact (file, opsional), pcb_mode (opsional);
+                                      ?format=docx mengembalikan dokumen langsung
+    GET  /api/reports/<id>            teks per bagian analisis
+    GET  /api/reports/<id>/document   dokumen .docx
+
+Hasil laporan disimpan di disk (api_results_dir) sehingga bisa diambil dari worker mana pun.
+"""
+import os
+import re
+import io
+import sys
+import json
+import time
+import uuid
+import signal
+import argparse
+import threading
+from collections import Counter
+from email.parser import BytesParser
+from email import policy
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+import RapportLCV_3fcoklat as rapport
+
+API_RESULTS_DIR = rapport.get_setting("api_results_dir", ".cache/api_results")
+API_MAX_UPLOAD_MB = rapport.get_setting("api_max_upload_mb", 50)
+# Laporan yang dibuat bersamaan per worker; permintaan lain menunggu slot sampai API_QUEUE_TIMEOUT lalu ditolak (503)
+API_MAX_REPORTS = rapport.get_setting("api_max_reports", rapport.JOB_MAX_CONCURRENT)
+API_QUEUE_TIMEOUT = rapport.get_setting("api_queue_timeout", 30.0)
+
+UPLOAD_EXTENSIONS = ('xlsx', 'xls', 'pdf', 'png', 'jpg', 'jpeg', 'tif', 'tiff')
+PCB_MODES = ('separate', 'combined')
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+REPORT_ID = re.compile(r'^[0-9a-f]{32}$')
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or []
+
+# Metrik per proses worker: jumlah permintaan per rute/status dan statistik pembuatan laporan
+class ApiMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = Counter()
+        self.reports = Counter()
+        self.report_seconds = 0.0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, route, status):
+        with self._lock:
+            self.requests[f"{route} {status}"] += 1
+
+    def report_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def report_finished(self, status, seconds):
+        with self._lock:
+            self.in_flight -= 1
+            self.reports[status] += 1
+            self.report_seconds += seconds
+
+    def report_rejected(self):
+        with self._lock:
+            self.reports['rejected'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            finished = self.reports['ok'] + self.reports['error']
+            return {
+                'pid': os.getpid(),
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'requests': dict(self.requests),
+                'reports': dict(self.reports),
+                'reports_in_flight': self.in_flight,
+                'report_seconds_total': round(self.report_seconds, 2),
+                'report_seconds_avg': round(self.report_seconds / finished, 2) if finished else None
+            }
+
+METRICS = ApiMetrics()
+REPORT_SLOTS = threading.BoundedSemaphore(API_MAX_REPORTS)
+
+# ===================== PENYIMPANAN HASIL =====================
+def result_path(report_id, suffix):
+    return os.path.join(API_RESULTS_DIR, f"{report_id}{suffix}")
+
+def write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# Hasil lebih tua dari JOB_TTL_MINUTES dihapus, sama seperti job di UI
+def purge_expired_results():
+    cutoff = time.time() - rapport.JOB_TTL_MINUTES * 60
+    try:
+        names = os.listdir(API_RESULTS_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(API_RESULTS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # Sudah dihapus worker lain
+
+def save_result(result, document):
+    os.makedirs(API_RESULTS_DIR, exist_ok=True)
+    if document is not None:
+        write_atomic(result_path(result['id'], '.docx'), document)
+    # JSON ditulis terakhir: keberadaannya menandakan hasil lengkap
+    write_atomic(result_path(result['id'], '.json'), json.dumps(result, ensure_ascii=False).encode('utf-8'))
+
+def load_result(report_id):
+    if not REPORT_ID.match(report_id):
+        raise ApiError(404, "Laporan tidak ditemukan")
+    try:
+        with open(result_path(report_id, '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ApiError(404, "Laporan tidak ditemukan atau sudah kedaluwarsa")
+
+# ===================== PEMBUATAN LAPORAN =====================
+def parse_multipart(body, content_type):
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+    )
+    if not message.is_multipart():
+        raise ApiError(400, "Body harus berupa multipart/form-data")
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if not name:
+            continue
+        payload = part.get_payload(decode=True) or b''
+        filename = part.get_filename()
+        if filename:
+            upload = io.BytesIO(payload)
+            upload.name = os.path.basename(filename)
+            files[name] = upload
+        else:
+            fields[name] = payload.decode('utf-8').strip()
+    return fields, files
+
+def validate_upload(upload, field):
+    if upload is None:
+        return None
+    extension = upload.name.rsplit('.', 1)[-1].lower()
+    if extension not in UPLOAD_EXTENSIONS:
+        raise ApiError(400, f"Format file {field} tidak didukung: {upload.name}")
+    return upload
+
+def generate_report(data, hsh, fungsi, pcb_file, impact_file, pcb_mode):
+    skor_total, skor_survei, skor_benchmark_evidence, skor_benchmark_survei = data
+    with rapport.span('report', hsh=hsh, fungsi=fungsi, mode='api'):
+        pcb_content = rapport.read_uploaded_file(pcb_file, max_chars=rapport.PCB_CHAR_BUDGET)
+        impact_content = rapport.read_uploaded_file(impact_file, max_chars=rapport.IMPACT_MAX_CHARS) if impact_file else None
+        analyses = rapport.run_report_analyses(
+            pcb_content, impact_content, skor_total, skor_survei, skor_benchmark_evidence,
+            skor_benchmark_survei, hsh, fungsi, pcb_mode=pcb_mode
+        )
+        doc_io = rapport.create_word_document_safe(fungsi, analyses)
+    return analyses, doc_io.getvalue() if doc_io is not None else None
+
+def create_report(environ):
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    if length <= 0:
+        raise ApiError(411, "Header Content-Length wajib diisi")
+    if length > API_MAX_UPLOAD_MB * 1024 * 1024:
+        raise ApiError(413, f"Ukuran upload melebihi {API_MAX_UPLOAD_MB} MB")
+    fields, files = parse_multipart(environ['wsgi.input'].read(length), environ.get('CONTENT_TYPE', ''))
+
+    hsh, fungsi = fields.get('hsh'), fields.get('fungsi')
+    if not hsh or not fungsi:
+        raise ApiError(400, "Field hsh dan fungsi wajib diisi")
+    pcb_mode = fields.get('pcb_mode') or None
+    if pcb_mode is not None and pcb_mode not in PCB_MODES:
+        raise ApiError(400, f"pcb_mode harus salah satu dari: {', '.join(PCB_MODES)}")
+    pcb_file = validate_upload(files.get('pcb'), 'PCB')
+    impact_file = validate_upload(files.get('impact'), 'Impact')
+    if pcb_file is None:
+        raise ApiError(400, "File PCB wajib diupload")
+
+    scoring_data = rapport.get_scoring_data()
+    if fungsi not in scoring_data.index.fungsi_for(hsh):
+        raise ApiError(404, f"Fungsi '{fungsi}' tidak ditemukan untuk HSH '{hsh}'")
+
+    if not REPORT_SLOTS.acquire(timeout=API_QUEUE_TIMEOUT):
+        METRICS.report_rejected()
+        raise ApiError(503, "Server sedang sibuk, coba lagi nanti", [('Retry-After', str(int(API_QUEUE_TIMEOUT)))])
+    METRICS.report_started()
+    started = time.time()
+    status = 'error'
+    try:
+        analyses, document = generate_report(scoring_data.as_tuple(), hsh, fungsi, pcb_file, impact_file, pcb_mode)
+        status = 'ok' if document is not None else 'error'
+    finally:
+        REPORT_SLOTS.release()
+        METRICS.report_finished(status, time.time() - started)
+
+    purge_expired_results()
+    result = {
+        'id': uuid.uuid4().hex,
+        'hsh': hsh,
+        'fungsi': fungsi,
+        'pcb_mode': pcb_mode or rapport.PCB_ANALYSIS_MODE,
+        'status': status,
+        'sections': [
+            {'key': key, 'title': title, 'text': analyses.get(key, "")}
+            for key, title in rapport.ANALYSIS_SECTIONS.items()
+        ],
+        'failed_sections': [key for key, text in analyses.items() if rapport.is_error_response(text)],
+        'filename': rapport.report_filename(fungsi),
+        'seconds': round(time.time() - started, 2),
+        'created': time.time()
+    }
+    save_result(result, document)
+    return result, document
+
+# ===================== ROUTING WSGI =====================
+def json_response(status, payload, headers=None):
+    return status, [('Content-Type', 'application/json; charset=utf-8')] + (headers or []), \
+        json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+def docx_response(document, filename):
+    return 200, [
+        ('Content-Type', DOCX_CONTENT_TYPE),
+        ('Content-Disposition', f'attachment; filename="{filename}"')
+    ], document
+
+def handle_health(environ):
+    health = {'status': 'ok', 'pid': os.getpid(), 'api_key_configured': bool(rapport.DEEPSEEK_API_KEY)}
+    try:
+        health['fungsi_count'] = len(rapport.get_scoring_data().index.pairs)
+    except Exception as e:
+        return json_response(503, {**health, 'status': 'error', 'error': f"Gagal memuat data skor: {e}"})
+    breaker = rapport.get_circuit_breaker()
+    health['circuit_breaker'] = breaker.state
+    if breaker.state != 'closed' or not health['api_key_configured']:
+        health['status'] = 'degraded'
+    return json_response(200, health)
+
+def handle_metrics(environ):
+    metrics = METRICS.snapshot()
+    breaker = rapport.get_circuit_breaker()
+    metrics['circuit_breaker'] = {'state': breaker.state, 'failures': breaker.failures}
+    metrics['rate_limiter'] = {'rate_scale': round(rapport.get_rate_limiter().rate_scale, 3)}
+    llm_cache = rapport.get_llm_cache()
+    metrics['llm_cache'] = llm_cache.stats() if llm_cache is not None else None
+    try:
+        metrics['scoring_data_bytes'] = rapport.get_scoring_data().total_bytes()
+    except Exception:
+        metrics['scoring_data_bytes'] = None
+    return json_response(200, metrics)
+
+def handle_options(environ):
+    return json_response(200, {'hsh': rapport.get_scoring_data().index.fungsi_by_hsh})
+
+def handle_create_report(environ):
+    result, document = create_report(environ)
+    wants_docx = 'format=docx' in environ.get('QUERY_STRING', '').split('&')
+    if wants_docx:
+        if document is None:
+            return json_response(500, {'error': "Gagal membuat dokumen Word", 'id': result['id']})
+        return docx_response(document, result['filename'])
+    location = f"/api/reports/{result['id']}"
+    return json_response(201, {**result, 'document_url': f"{location}/document"}, [('Location', location)])
+
+def handle_get_report(environ, report_id):
+    result = load_result(report_id)
+    return json_response(200, {**result, 'document_url': f"/api/reports/{report_id}/document"})
+
+def handle_get_document(environ, report_id):
+    result = load_result(report_id)
+    try:
+        with open(result_path(report_id, '.docx'), 'rb') as f:
+            document = f.read()
+    except FileNotFoundError:
+        raise ApiError(404, "Dokumen untuk laporan ini tidak tersedia")
+    return docx_response(document, result['filename'])
+
+ROUTES = [
+    ('GET', re.compile(r'^/health$'), handle_health),
+    ('GET', re.compile(r'^/metrics$'), handle_metrics),
+    ('GET', re.compile(r'^/api/options$'), handle_options),
+    ('POST', re.compile(r'^/api/reports$'), handle_create_report),
+    ('GET', re.compile(r'^/api/reports/([^/]+)$'), handle_get_report),
+    ('GET', re.compile(r'^/api/reports/([^/]+)/document$'), handle_get_document)
+]
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error',
+               503: 'Service Unavailable'}
+
+def application(environ, start_response):
+    method = environ.get('REQUEST_METHOD', 'GET')
+    path = environ.get('PATH_INFO', '') or '/'
+    route = 'unknown'
+    try:
+        matched = [(m, pattern, handler) for m, pattern, handler in ROUTES if pattern.match(path)]
+        if not matched:
+            raise ApiError(404, "Endpoint tidak ditemukan")
+        for route_method, pattern, handler in matched:
+            if route_method == method:
+                route = f"{method} {pattern.pattern.strip('^$')}"
+                status, headers, body = handler(environ, *pattern.match(path).groups())
+                break
+        else:
+            raise ApiError(405, "Metode tidak didukung", [('Allow', ', '.join(m for m, _, _ in matched))])
+    except ApiError as e:
+        status, headers, body = json_response(e.status, {'error': str(e)}, e.headers)
+    except Exception as e:
+        status, headers, body = json_response(500, {'error': f"Kesalahan internal: {e}"})
+    METRICS.record_request(route, status)
+    start_response(f"{status} {STATUS_TEXT.get(status, '')}".strip(), headers + [('Content-Length', str(len(body)))])
+    return [body]
+
+# ===================== SERVER MULTI-WORKER =====================
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+# Socket dibuka sekali lalu worker di-fork dan sama-sama melayani socket tersebut;
+# data skor dimuat sebelum fork sehingga halaman memorinya dipakai bersama (copy-on-write)
+def serve(host, port, workers):
+    server = make_server(host, port, application, server_class=ThreadingWSGIServer, handler_class=WSGIRequestHandler)
+    rapport.load_excel_files()
+    print(f"Rapport API berjalan di http://{host}:{port} dengan {workers} worker", file=sys.stderr)
+    if workers <= 1 or not hasattr(os, 'fork'):
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    # Worker yang mati (mis. crash) diganti selama server belum dihentikan
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} berhenti, menjalankan worker baru", file=sys.stderr)
+            spawn()
+    server.server_close()
+    return 0
+
+def run_api_cli(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API Rapport Writer Assistance")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Jumlah proses worker")
+    parser.add_argument("--api-concurrency", type=int, default=None,
+                        help="Batas permintaan DeepSeek bersamaan per worker")
+    args = parser.parse_args(argv)
+    if args.api_concurrency:
+        rapport.set_api_concurrency(args.api_concurrency)
+    return serve(args.host, args.port, args.workers)
+
+if __name__ == "__main__":
+    sys.exit(run_api_cli())